@@ -7,27 +7,217 @@ temp org, which holds temporary dashboards.  The Grafana API key is sent through
 "Authorization": "Bearer API_KEY".  Every dashboard API request uses a generic JSON template which is defined
 in the PAYLOAD_TEMPLATE variable.  Specific dashboards are accessed through their UID.
 Many of the functions only update specific parts of the dashboards such as their time ranges or y min/max
+Dashboards are kept in a cache keyed by (org, uid) together with their Grafana version.  Edits are applied to the
+cached copy and saved with that version, so a dashboard is only fetched again when it is not cached, expired, or the
+save failed because someone else changed it in the meantime.
+All requests go through one pooled requests Session per org which holds that org's Authorization header, uses
+connect/read timeouts, and retries idempotent calls (GET/DELETE) with backoff.  The latency of every call is recorded
+in the Metrics registry.
+The uids and titles of every org's dashboards are kept in a DashboardIndex, which answers the dashboard lists and
+name lookups without searching Grafana.
 """
 
 import copy
-from datetime import datetime
 import requests
-import csv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import Panel_Templates
-import DB_Processor
+import Dashboard_Index
+import Expiry_Index
+import Metrics
+import Panel_ID_Allocator
+import Query_Builder
+import Rollup_Manager
+import Temp_Dash_Pool
 import os
+import threading
+import time
+import uuid
 
+# shared by every insert into a dashboard so new and copied panels never get clashing ids
+panel_ids = Panel_ID_Allocator.PanelIDAllocator()
 
+
+"""
+Edit session for one dashboard.  Changes such as time ranges, panel targets, y min/max and new panels are queued and
+then applied together to one copy of the dashboard, which is saved to Grafana once.  This keeps a request that makes
+several changes to one round trip and one new dashboard version.
+Panels are looked up through a dict keyed by panel id that is built once per save, and every change only writes the
+values that differ from the dashboard.  If none of the queued changes alter the dashboard the save is skipped.
+
+Args:
+    api: GrafanaAPIProcessor used to read and save the dashboard
+    is_temp: decides whether to use main org or temp org api key
+    dash_uid: target dash uid
+"""
+class DashEditSession:
+    def __init__(self, api, is_temp, dash_uid):
+        self.__api = api
+        self.is_temp = is_temp
+        self.dash_uid = dash_uid
+        self.__changes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.save()
+        return False
+
+    """
+    Indexes the panels of a dashboard by id, including panels nested in collapsed rows
+
+    Args:
+        dash: dashboard JSON as returned by the Grafana API
+
+    Returns: dict of panel id -> panel JSON (the panels themselves, not copies)
+    """
+    @staticmethod
+    def index_panels(dash):
+        panels = {}
+        for panel in dash['dashboard'].get('panels', []):
+            panels[int(panel['id'])] = panel
+            for nested_panel in panel.get('panels', []):
+                panels[int(nested_panel['id'])] = nested_panel
+        return panels
+
+    """
+    Queues a new time range for the dashboard
+
+    Args:
+        time_from: Dashboards new time from arg
+        time_to: Dashboards new time to arg
+    """
+    def update_dash_time(self, time_from, time_to):
+        def change(dash, panels):
+            new_time = {"from": time_from, "to": time_to}
+            if all(dash['dashboard']['time'].get(key) == value for key, value in new_time.items()):
+                return False
+            dash['dashboard']['time'].update(new_time)
+            return True
+
+        self.__changes.append(change)
+
+    """
+    Queues new targets for existing panels.  Downsampled panels keep their aggregate
+
+    Args:
+        panel_table_col: preformatted dict with dashes panel ids, tables, and columns
+    """
+    def update_temp_dash(self, panel_table_col):
+        tables_cols = {}
+        for updated_panel in panel_table_col:
+            tables_cols[int(updated_panel['id'])] = [(table['table_name'], table['cols'])
+                                                     for table in updated_panel['tables']]
+
+        def change(dash, panels):
+            changed = False
+            for panel_id, panel_tables_cols in tables_cols.items():
+                panel = panels.get(panel_id)
+                if panel is None:
+                    continue
+                aggregate = None
+                if len(panel.get('targets', [])) != 0:
+                    aggregate = Query_Builder.aggregate_of(panel['targets'][0])
+                targets = self.__api.target_builder.build_targets(panel_tables_cols, aggregate)
+                if targets != panel.get('targets'):
+                    panel['targets'] = targets
+                    changed = True
+            return changed
+
+        self.__changes.append(change)
+
+    """
+    Queues a new y min max range for a panel
+
+    Args:
+        panel_id: Id of target panel to change y min max
+        input_min: new y min
+        input_max: new y max
+    """
+    def update_y_min_max(self, panel_id, input_min, input_max):
+        def change(dash, panels):
+            panel = panels.get(int(panel_id))
+            if panel is None:
+                return False
+            defaults = panel['fieldConfig']['defaults']
+            changed = False
+            for key, value in (('min', input_min), ('max', input_max)):
+                if value is not None and defaults.get(key) != value:
+                    defaults[key] = value
+                    changed = True
+            return changed
+
+        self.__changes.append(change)
+
+    """
+    Queues a new panel.  The panel id is allocated immediately so it can be used before the session is saved
+
+    Args:
+        values: Preformatted dict with new panel info.  Optional keys: aggregate to downsample the panel's queries
+            with (avg/min/max/last) and max_points to limit the number of points Grafana requests for the panel
+
+    Returns: New panel id
+    """
+    def insert_new_panel(self, values):
+        index = panel_ids.allocate()
+
+        targets = self.__api.target_builder.build_targets([(table[0], table[1:]) for table in values['table']],
+                                                          values.get('aggregate'))
+
+        def change(payload, panels):
+            new_panel = copy.deepcopy(Panel_Templates.LINE_GRAPH)
+            new_panel['id'] = index
+            new_panel['title'] = values['graph_name']
+            new_panel['targets'] = targets
+            if values.get('max_points') is not None:
+                new_panel['maxDataPoints'] = values['max_points']
+            payload['dashboard']['panels'].append(new_panel)
+            panels[index] = new_panel
+            return True
+
+        self.__changes.append(change)
+        return index
+
+    """
+    Applies every queued change to the dashboard and saves it once.  Nothing is sent to Grafana when the changes
+    leave the dashboard as it was
+
+    Returns: requests post data or None if no changes were queued or none of them changed the dashboard
+    """
+    def save(self):
+        if len(self.__changes) == 0:
+            return None
+        changes = self.__changes
+        self.__changes = []
+
+        def modify(dash):
+            panels = self.index_panels(dash)
+            changed = False
+            for change in changes:
+                changed = change(dash, panels) or changed
+            return changed
+
+        return self.__api.modify_dash(self.is_temp, self.dash_uid, modify)
+
+
+@Metrics.instrumented()
 class GrafanaAPIProcessor:
     temp_org_api_key = os.environ.get("GRAFANA_API_TEMP_ORG_KEY")
     main_org_api_key = os.environ.get("GRAFANA_API_MAIN_ORG_KEY")
-    TEMP_DASH_INITAL_NAME = "TEMP_DASH_INITIALIZER_GET_UID_HERE"
-    EVEN_LOG_NAME = 'temp_dash_log_even.csv'
-    ODD_LOG_NAME = 'temp_dash_log_odd.csv'
+    TEMP_DASH_UID_LENGTH = 16
     SERVER = "http://localhost:3000"
+    DASH_CACHE_TTL = int(os.environ.get("DASH_CACHE_TTL", 300))
+    CONNECT_TIMEOUT = float(os.environ.get("GRAFANA_CONNECT_TIMEOUT", 3.05))
+    READ_TIMEOUT = float(os.environ.get("GRAFANA_READ_TIMEOUT", 30))
+    MAX_RETRIES = int(os.environ.get("GRAFANA_MAX_RETRIES", 3))
+    RETRY_BACKOFF = float(os.environ.get("GRAFANA_RETRY_BACKOFF", 0.3))
+    POOL_SIZE = int(os.environ.get("GRAFANA_POOL_SIZE", 10))
+    GRID_WIDTH = 24
 
     header = {"Authorization": "Bearer "}
-    url = 'http://localhost:3000/api/dashboards/db'  # curl -H
+    url = SERVER + '/api/dashboards/db'  # curl -H
     PAYLOAD_TEMPLATE = {
         "dashboard": {
             "id": None,
@@ -46,19 +236,222 @@ class GrafanaAPIProcessor:
         },
     }
 
-    __db = DB_Processor.db()
+    target_builder = Query_Builder.TargetBuilder(rollups=Rollup_Manager.from_env())
+    __expiry_index = Expiry_Index.ExpiryIndex()
+    __temp_dash_pool = Temp_Dash_Pool.TempDashPool()
+    __dash_cache = {}
+    __dash_cache_lock = threading.Lock()
+    __dash_indexes = {}
+    __dash_indexes_lock = threading.Lock()
+    __sessions = {}
+    __sessions_lock = threading.Lock()
+    __sessions_pid = os.getpid()
+
+    """
+    Gets the HTTP session for an org, creating it on first use.  The session keeps connections to Grafana alive,
+    sends the org's API key with every request and retries failed GET/DELETE requests with exponential backoff
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+
+    Returns: requests Session for the org
+    """
+    def get_session(self, is_temp):
+        if GrafanaAPIProcessor.__sessions_pid != os.getpid():
+            # connections inherited from the parent process must not be shared with it
+            GrafanaAPIProcessor.__sessions = {}
+            GrafanaAPIProcessor.__sessions_lock = threading.Lock()
+            GrafanaAPIProcessor.__sessions_pid = os.getpid()
+        session = self.__sessions.get(is_temp)
+        if session is None:
+            with self.__sessions_lock:
+                session = self.__sessions.get(is_temp)
+                if session is None:
+                    session = requests.Session()
+                    session.headers['Authorization'] = self.header['Authorization'] \
+                        + (self.temp_org_api_key if is_temp else self.main_org_api_key)
+                    session.verify = False
+                    retry = Retry(total=self.MAX_RETRIES, backoff_factor=self.RETRY_BACKOFF,
+                                  status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'DELETE']),
+                                  raise_on_status=False)
+                    adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE,
+                                          max_retries=retry)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self.__sessions[is_temp] = session
+        return session
+
+    """
+    Sends a request to Grafana through the org's session and records how long it took and how large the dashboard
+    payloads were
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        method: HTTP method
+        url: request url
+        call_name: name the latency is recorded under
+        json: request body
+
+    Returns: requests response
+    """
+    def __request(self, is_temp, method, url, call_name, json=None):
+        start = time.perf_counter()
+        Metrics.count_call("grafana", call_name)
+        try:
+            r = self.get_session(is_temp).request(method, url, json=json,
+                                                  timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+            if json is not None:
+                Metrics.observe_payload("sent", len(r.request.body or b""))
+            if call_name == 'get_dash':
+                Metrics.observe_payload("received", len(r.content))
+            return r
+        finally:
+            Metrics.record_step("grafana." + call_name, time.perf_counter() - start)
+
+    """
+    Gets a copy of a cached dashboard
+
+    Args:
+        is_temp: decides whether to use main org or temp org cache
+        dash_uid: target dash uid
+
+    Returns: copy of the cached dashboard JSON or None if it is not cached or expired
+    """
+    def __cache_get(self, is_temp, dash_uid):
+        with self.__dash_cache_lock:
+            entry = self.__dash_cache.get((is_temp, dash_uid))
+        if entry is None or time.monotonic() - entry[0] > self.DASH_CACHE_TTL:
+            return None
+        return copy.deepcopy(entry[1])
+
+    def __cache_put(self, is_temp, dash_uid, dash):
+        entry = (time.monotonic(), copy.deepcopy(dash))
+        with self.__dash_cache_lock:
+            self.__dash_cache[(is_temp, dash_uid)] = entry
+
+    """
+    Removes a dashboard from the cache so the next read fetches it from Grafana
+
+    Args:
+        is_temp: decides whether to use main org or temp org cache
+        dash_uid: target dash uid
+    """
+    def invalidate_dash(self, is_temp, dash_uid):
+        with self.__dash_cache_lock:
+            self.__dash_cache.pop((is_temp, dash_uid), None)
+
+    """
+    Saves a dashboard and stores the saved JSON with its new version in the cache.  The dashboard is saved with the
+    version it was read at, so Grafana rejects the save with a version-mismatch if someone else changed it
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        dash: dashboard JSON as returned by get_dash_info_by_uid
+        overwrite: save even if the dashboard was changed by someone else
+
+    Returns: requests post data
+    """
+    def save_dash(self, is_temp, dash, overwrite=False):
+        payload = {
+            "dashboard": dash['dashboard'],
+            "overwrite": overwrite
+        }
+        if 'folderId' in dash.get('meta', {}):
+            payload['folderId'] = dash['meta']['folderId']
+
+        r = self.__request(is_temp, 'POST', self.url, 'save_dash', json=payload)
+        if r.status_code == 200:
+            info = r.json()
+            dash['dashboard']['id'] = info.get('id', dash['dashboard'].get('id'))
+            dash['dashboard']['uid'] = info.get('uid', dash['dashboard'].get('uid'))
+            dash['dashboard']['version'] = info.get('version', dash['dashboard'].get('version'))
+            self.__cache_put(is_temp, dash['dashboard']['uid'], dash)
+            self.update_dash_index(is_temp, dash['dashboard']['uid'], dash['dashboard']['title'])
+        elif dash['dashboard'].get('uid') is not None:
+            self.invalidate_dash(is_temp, dash['dashboard']['uid'])
+        return r
+
+    """
+    Reads a dashboard, applies modify to it and saves it.  If the save fails because the dashboard was changed by
+    someone else, the dashboard is fetched again and modify is applied once more to the fresh copy
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        dash_uid: target dash uid
+        modify: function that changes the dashboard JSON in place.  Returning False skips the save
+
+    Returns: requests post data or None if modify left the dashboard unchanged
+    """
+    def modify_dash(self, is_temp, dash_uid, modify):
+        dash = self.get_dash_info_by_uid(is_temp, dash_uid)
+        if modify(dash) is False:
+            return None
+        r = self.save_dash(is_temp, dash)
+        if r.status_code == 412 and r.json().get('status') == 'version-mismatch':
+            dash = self.get_dash_info_by_uid(is_temp, dash_uid)
+            if modify(dash) is False:
+                return None
+            r = self.save_dash(is_temp, dash)
+        return r
+
+    """
+    Starts an edit session on a dashboard.  Changes queued on the session are applied to one copy of the dashboard
+    and sent to Grafana in a single save.  Used as a context manager the session saves when the block ends
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        dash_uid: target dash uid
+
+    Returns: DashEditSession for the dashboard
+    """
+    def edit_dash(self, is_temp, dash_uid):
+        return DashEditSession(self, is_temp, dash_uid)
+
+    """
+    Gets the dashboard index of an org, creating it and starting its background sync on first use
+
+    Args:
+        is_temp: decides whether to use main org or temp org index
+
+    Returns: DashboardIndex for the org
+    """
+    def get_dash_index(self, is_temp):
+        index = self.__dash_indexes.get(is_temp)
+        if index is None:
+            with self.__dash_indexes_lock:
+                index = self.__dash_indexes.get(is_temp)
+                if index is None:
+                    index = Dashboard_Index.DashboardIndex(
+                        lambda page, limit: self.get_dash_list(is_temp, page, limit),
+                        name="dash-index-" + ("temp" if is_temp else "main"))
+                    self.__dash_indexes[is_temp] = index
+        index.start()
+        return index
+
+    """
+    Records a dashboard write in the org's dashboard index, if the org has one
+
+    Args:
+        is_temp: decides whether to use main org or temp org index
+        dash_uid: target dash uid
+        title: new title of the dashboard, None if it was deleted
+    """
+    def update_dash_index(self, is_temp, dash_uid, title=None):
+        index = self.__dash_indexes.get(is_temp)
+        if index is None:
+            return
+        if title is None:
+            index.remove(dash_uid)
+        else:
+            index.put(dash_uid, title)
+
     """
     Gets uids and titles of all dashboards in main org
         
-    Returns: List with (uid, title)
+    Returns: List with (uid, title) sorted by title
    """
     def get_dash_info_list(self):
-        dash_list = self.get_dash_list(False)
-        output = []
-        for dash in dash_list:
-            option = (dash['uid'], dash['title'])
-            output.append(option)
-        return output
+        return self.get_dash_index(False).all()
 
     """
     Updates time for targeted dashboard
@@ -72,13 +465,9 @@ class GrafanaAPIProcessor:
     Returns: requests post data
    """
     def update_dash_time(self, time_from, time_to, is_temp, dash_uid):
-        target_dash = self.get_dash_info_by_uid(is_temp, dash_uid)
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if is_temp else self.main_org_api_key
-        target_dash['dashboard']['time']['from'] = time_from
-        target_dash['dashboard']['time']['to'] = time_to
-        r = requests.post(url=self.url, headers=header, json=target_dash, verify=False)
-        return r
+        edit = self.edit_dash(is_temp, dash_uid)
+        edit.update_dash_time(time_from, time_to)
+        return edit.save()
 
     """ 
     Updates targeted dashboard's panels
@@ -90,27 +479,9 @@ class GrafanaAPIProcessor:
     Returns: requests post data
     """
     def update_temp_dash(self, uid, panel_table_col):
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key
-
-        dash = self.get_dash_info_by_uid(True, uid)
-        for index, panel in enumerate(dash['dashboard']['panels']):
-            for updated_panel in panel_table_col:
-                if int(panel['id']) == int(updated_panel['id']):
-                    panel['targets'].clear()
-                    for table in updated_panel['tables']:
-                        new_target = copy.deepcopy(Panel_Templates.QUERY_TEMPLATE)
-                        panel['targets'].append(new_target)
-
-                        sql = "SELECT\n  time AS \"time\",\n  " + table['cols'] + "\nFROM "\
-                            + table['table_name'] + "\nWHERE $__timeFilter(time)"
-
-                        dash['dashboard']['panels'][index]['targets'][-1]['rawSql'] = sql
-                        dash['dashboard']['panels'][index]['targets'][-1]['table'] = table['table_name']
-                        dash['dashboard']['panels'][index]['targets'][-1]['select'][0][0]['params'] = table['cols']
-
-        r = requests.post(url=self.url, json=dash, headers=header, verify=False)
-        return r
+        edit = self.edit_dash(True, uid)
+        edit.update_temp_dash(panel_table_col)
+        return edit.save()
 
     """ 
     Deletes target dashboard
@@ -121,15 +492,60 @@ class GrafanaAPIProcessor:
     Returns: requests post data
     """
     def delete_dash(self, is_temp, uid):
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if is_temp else self.main_org_api_key
-
         url = self.SERVER + "/api/dashboards/uid/" + uid
-        r = requests.delete(url=url, headers=header, verify=False)
+        r = self.__request(is_temp, 'DELETE', url, 'delete_dash')
+        self.invalidate_dash(is_temp, uid)
+        if r.status_code in (200, 404):
+            self.update_dash_index(is_temp, uid)
         return r
 
+    """
+    Gets copies of the panels of a dashboard whose ids were requested
+
+    Args:
+        dash: dashboard JSON as returned by get_dash_info_by_uid
+        panel_ids: list of panel ids
+
+    Returns: list of panel JSON copies in dashboard order
+    """
+    @staticmethod
+    def select_panels(dash, panel_ids):
+        panel_ids = {int(panel_id) for panel_id in panel_ids}
+        return [copy.deepcopy(panel) for panel in dash['dashboard'].get('panels', []) if int(panel['id']) in panel_ids]
+
+    """
+    Appends panels to a dashboard.  Every panel gets a fresh id from the panel id allocator and is laid out left to
+    right in rows of GRID_WIDTH below the existing panels, keeping its width and height
+
+    Args:
+        dash: dashboard JSON as returned by get_dash_info_by_uid
+        panels: list of panel JSON to append, changed in place
+    """
+    @staticmethod
+    def append_panels(dash, panels):
+        existing = dash['dashboard'].setdefault('panels', [])
+        new_ids = iter(panel_ids.allocate_for_dash(dash, len(panels)))
+        y = max([panel.get('gridPos', {}).get('y', 0) + panel.get('gridPos', {}).get('h', 0) for panel in existing],
+                default=0)
+        x = 0
+        row_height = 0
+        for panel in panels:
+            grid_pos = panel.get('gridPos', {})
+            w = min(grid_pos.get('w', Panel_Templates.LINE_GRAPH['gridPos']['w']), GrafanaAPIProcessor.GRID_WIDTH)
+            h = grid_pos.get('h', Panel_Templates.LINE_GRAPH['gridPos']['h'])
+            if x + w > GrafanaAPIProcessor.GRID_WIDTH:
+                x = 0
+                y += row_height
+                row_height = 0
+            panel['id'] = next(new_ids)
+            panel['gridPos'] = {"h": h, "w": w, "x": x, "y": y}
+            x += w
+            row_height = max(row_height, h)
+            existing.append(panel)
+
     """ 
-    Copies specific panels from one dashboard in temp org to another dashboard in main org
+    Copies specific panels from one dashboard in temp org to another dashboard in main org.  The copies get new ids
+    and are laid out below the target's panels
     
     Args:
         source_uid: Temp org dashboard uid where panels will be copied from
@@ -139,18 +555,12 @@ class GrafanaAPIProcessor:
     Returns: requests post data
     """
     def copy_panels(self, source_uid, target_uid, panel_ids):
-        header = self.header.copy()
-        header['Authorization'] += self.main_org_api_key
         source_dash = self.get_dash_info_by_uid(True, source_uid)
-        target_dash = self.get_dash_info_by_uid(False, target_uid)
-        target_dash['overwrite'] = True
-        for panel in source_dash['dashboard']['panels']:
-            for panel_id in panel_ids:
-                if int(panel['id']) == int(panel_id):
-                    target_dash['dashboard']['panels'].append(panel)
-
-        r = requests.post(url=self.url, json=target_dash, headers=header, verify=False)
-        return r
+
+        def modify(target_dash):
+            self.append_panels(target_dash, self.select_panels(source_dash, panel_ids))
+
+        return self.modify_dash(False, target_uid, modify)
 
     """ 
     Gets the JSON of a specified dashboard by uid
@@ -162,11 +572,16 @@ class GrafanaAPIProcessor:
     Returns: JSON of target dashboard
     """
     def get_dash_info_by_uid(self, is_temp, dash_uid):
-        url = "http://localhost:3000/api/dashboards/uid/" + dash_uid
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if is_temp else self.main_org_api_key
-        info = requests.get(headers=header, url=url, verify=False)
-        return info.json()
+        dash = self.__cache_get(is_temp, dash_uid)
+        if dash is not None:
+            return dash
+
+        url = self.SERVER + "/api/dashboards/uid/" + dash_uid
+        info = self.__request(is_temp, 'GET', url, 'get_dash')
+        dash = info.json()
+        if info.status_code == 200:
+            self.__cache_put(is_temp, dash_uid, dash)
+        return dash
 
     """ 
     Gets the JSON of a specified dashboard by name
@@ -178,13 +593,13 @@ class GrafanaAPIProcessor:
     Returns: JSON of target dashboard
     """
     def get_dash_info_by_name(self, is_temp, dash_name):
-        dash_list = self.get_dash_list(is_temp)
-        uid = ""
-        for dash in dash_list:
-            if dash['title'] == dash_name:
-                uid = dash['uid']
-                break
-        return self.get_dash_info_by_uid(is_temp, uid)
+        index = self.get_dash_index(is_temp)
+        uid = index.get_uid(dash_name)
+        if uid is None:
+            # the dashboard may have been created outside this app since the last sync
+            index.sync()
+            uid = index.get_uid(dash_name)
+        return self.get_dash_info_by_uid(is_temp, "" if uid is None else uid)
 
     # updates the y min/max for a panel
     """ 
@@ -200,22 +615,9 @@ class GrafanaAPIProcessor:
     Returns: requests post data
     """
     def update_y_min_max(self, is_temp, panel_id, dash_uid, input_min, input_max):
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if is_temp else self.main_org_api_key
-
-        target_dash = self.get_dash_info_by_uid(is_temp, dash_uid)
-        for index in range(len(target_dash['dashboard']['panels'])):
-            if int(target_dash['dashboard']['panels'][index]['id']) == int(panel_id):
-
-                if input_min is not None:
-                    target_dash['dashboard']['panels'][index]['fieldConfig']['defaults']['min'] = input_min
-                if input_max is not None:
-
-                    target_dash['dashboard']['panels'][index]['fieldConfig']['defaults']['max'] = input_max
-                break
-
-        r = requests.post(url=self.url, headers=header, json=target_dash, verify=False)
-        return r
+        edit = self.edit_dash(is_temp, dash_uid)
+        edit.update_y_min_max(panel_id, input_min, input_max)
+        return edit.save()
 
     """ 
     Inserts a new panel in a target dash
@@ -226,43 +628,9 @@ class GrafanaAPIProcessor:
     Returns: New panel id
     """
     def insert_new_panel(self, values):
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if values['is_temp'] else self.main_org_api_key
-
-        payload = self.get_dash_info_by_uid(values['is_temp'], values['uid'])
-        payload['overwrite'] = True
-
-        new_panel = copy.deepcopy(Panel_Templates.LINE_GRAPH)
-        payload['dashboard']['panels'].append(new_panel)
-        curr_index = len(payload['dashboard']['panels']) - 1
-        with open('panel_id_index.txt', 'r') as f:
-            index = f.readline()
-            index = int(index)
-        with open('panel_id_index.txt', 'w') as f:
-            f.writelines(str(index + 1))
-
-        payload['dashboard']['panels'][curr_index]['id'] = index
-        payload['dashboard']['panels'][curr_index]['title'] = values['graph_name']
-
-        i = 0
-        for table in values['table']:
-            new_target = copy.deepcopy(Panel_Templates.QUERY_TEMPLATE)
-            payload['dashboard']['panels'][curr_index]['targets'].append(new_target)
-            col_list = ""
-            for col in range(len(table) - 1):
-                col_list += table[col + 1] + " AS \""\
-                    + self.__db.convert_tabname_to_smaxvar(table[0]) + " " + table[col + 1] + "\""
-                if col + 1 != len(table) - 1:
-                    col_list += ","
-
-            sql = "SELECT\n  time AS \"time\",\n  " + col_list + "\nFROM " + table[0] + "\nWHERE $__timeFilter(time)"
-
-            payload['dashboard']['panels'][curr_index]['targets'][i]['rawSql'] = sql
-            payload['dashboard']['panels'][curr_index]['targets'][i]['table'] = table[0]
-            payload['dashboard']['panels'][curr_index]['targets'][i]['select'][0][0]['params'] = table[1:]
-            i += 1
-
-        requests.post(url=self.url, headers=header, json=payload, verify=False)
+        edit = self.edit_dash(values['is_temp'], values['uid'])
+        index = edit.insert_new_panel(values)
+        edit.save()
         return index
 
     # returns a list of all dashboards in a org depending if is_temp is specified
@@ -271,15 +639,16 @@ class GrafanaAPIProcessor:
 
     Args:
         is_temp: decides whether to use main org or temp org api key
+        page: page of results to get, starting at 1.  All dashboards are returned if not given
+        limit: number of results per page
 
     Returns: JSON of all dashboards info
     """
-    def get_dash_list(self, is_temp):
-        url = "http://localhost:3000/api/search?query=%"
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if is_temp else self.main_org_api_key
-
-        dash_list = requests.get(headers=header, url=url, verify=False)
+    def get_dash_list(self, is_temp, page=None, limit=None):
+        url = self.SERVER + "/api/search?query=%"
+        if page is not None:
+            url += "&type=dash-db&page=" + str(page) + "&limit=" + str(limit)
+        dash_list = self.__request(is_temp, 'GET', url, 'search')
         return dash_list.json()
 
     # create_dash() creates a new dashboard and panel in it.  It uses the dictionary "values"
@@ -288,68 +657,54 @@ class GrafanaAPIProcessor:
     Creates a new dashboard 
     
     Args:
-        values: Preformatted dict with dash info, panel info for dash, and specifier for temp or main org api key
+        values: Preformatted dict with dash info, panel info for dash, and specifier for temp or main org api key.
+            Optional keys: aggregate and max_points to downsample the panel, see DashEditSession.insert_new_panel
 
     Returns: requests post info
     """
     def create_dash(self, values):
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key if values['temp'] else self.main_org_api_key
-
         payload = copy.deepcopy(self.PAYLOAD_TEMPLATE)
         payload['dashboard']['title'] = values['dash_name']
 
         new_panel = copy.deepcopy(Panel_Templates.LINE_GRAPH)
+        new_panel['title'] = values['graph_name']
+        new_panel['targets'] = self.target_builder.build_targets([(table[0], table[1:]) for table in values['table']],
+                                                                 values.get('aggregate'))
+        if values.get('max_points') is not None:
+            new_panel['maxDataPoints'] = values['max_points']
         payload['dashboard']['panels'].append(new_panel)
-        payload['dashboard']['panels'][0]['title'] = values['graph_name']
-
-        i = 0
-        for table in values['table']:
-            new_target = copy.deepcopy(Panel_Templates.QUERY_TEMPLATE)
-            payload['dashboard']['panels'][0]['targets'].append(new_target)
-            col_list = ""
-            for col in range(len(table) - 1):
-                col_list += table[col + 1] + " AS \"" + self.__db.convert_tabname_to_smaxvar(table[0])\
-                    + table[col + 1] + "\""
-                if col + 1 != len(table) - 1:
-                    col_list += ","
-
-            sql = "SELECT\n  time AS \"time\",\n  " + col_list + "\nFROM " + table[0] + " WHERE $__timeFilter(time)"
-
-            payload['dashboard']['panels'][0]['targets'][i]['rawSql'] = sql
-            payload['dashboard']['panels'][0]['targets'][i]['table'] = table[0]
-            payload['dashboard']['panels'][0]['targets'][i]['select'][0][0]['params'] = table[1:]
-            i += 1
-
-        r = requests.post(url=self.url, headers=header, json=payload, verify=False)
-        return r
 
-    """ 
-        Creates a new dash in temp org and names it after its uid
+        r = self.save_dash(values['temp'], payload)
+        return r
 
-        Returns: uid of the new dash created
-        """
-    def create_temp_dash(self):
-        header = self.header.copy()
-        header['Authorization'] += self.temp_org_api_key
+    """
+    Creates an empty dash in temp org named after its uid.  The uid is generated here, so the dashboard is created
+    with a single save and no search is needed to find it
 
+    Returns: uid of the new dash created
+    """
+    def save_new_temp_dash(self):
+        uid = uuid.uuid4().hex[:self.TEMP_DASH_UID_LENGTH]
         payload = copy.deepcopy(self.PAYLOAD_TEMPLATE)
-        payload['dashboard']['title'] = self.TEMP_DASH_INITAL_NAME
+        payload['dashboard']['uid'] = uid
+        payload['dashboard']['title'] = uid
 
-        requests.post(url=self.url, headers=header, json=payload, verify=False)
+        r = self.save_dash(True, payload)
+        r.raise_for_status()
+        return uid
 
-        temp_dash_info = self.get_dash_info_by_name(True, self.TEMP_DASH_INITAL_NAME)
-        temp_dash_info['dashboard']['title'] = temp_dash_info['dashboard']['uid']
-        uid = temp_dash_info['dashboard']['uid']
-        requests.post(url=self.url, headers=header, json=temp_dash_info, verify=False)
+    """
+    Hands out a temp dash for a new user session.  Dashboards come from the prefetched pool when it has one, the
+    pool is refilled in the background
 
-        if int(datetime.today().strftime('%d')) % 2 == 1:
-            log_file = self.EVEN_LOG_NAME
-        else:
-            log_file = self.ODD_LOG_NAME
+    Returns: uid of the new dash created
+    """
+    def create_temp_dash(self):
+        self.__temp_dash_pool.start(self.save_new_temp_dash)
+        uid = self.__temp_dash_pool.take()
+        if uid is None:
+            uid = self.save_new_temp_dash()
 
-        with open(log_file, 'a') as logs:
-            log_writer = csv.writer(logs, delimiter=',')
-            log_writer.writerow([uid, str(datetime.now())])
+        self.__expiry_index.add(uid)
 
         return uid
@@ -0,0 +1,257 @@
+"""
+Async Grafana API Processor
+AsyncGrafanaAPIProcessor is the asyncio variant of GrafanaAPIProcessor for operations that fan out to many
+dashboards, such as deleting a list of dashboards or copying panels from several source dashboards.  Requests are
+sent concurrently through one aiohttp session per org, and at most MAX_CONCURRENCY requests are in flight at a time.
+Configuration (server, api keys, timeouts, retries) is shared with GrafanaAPIProcessor, and every write invalidates
+GrafanaAPIProcessor's dashboard cache.
+
+The processor is used as an async context manager so its sessions are bound to the running event loop:
+
+    async with AsyncGrafanaAPIProcessor() as api:
+        await api.delete_dashes(False, uids)
+
+Sync code, such as the Flask views, runs its coroutines to completion on a private event loop with run.
+"""
+
+import asyncio
+import copy
+import json as json_lib
+import aiohttp
+import API_Processor
+import Metrics
+import os
+
+
+class AsyncGrafanaAPIProcessor:
+    MAX_CONCURRENCY = int(os.environ.get("GRAFANA_MAX_CONCURRENCY", 10))
+    RETRY_STATUSES = (502, 503, 504)
+    IDEMPOTENT_METHODS = ('GET', 'DELETE')
+
+    def __init__(self, max_concurrency=None):
+        self.__sync_api = API_Processor.GrafanaAPIProcessor()
+        self.max_concurrency = self.MAX_CONCURRENCY if max_concurrency is None else max_concurrency
+        self.__sessions = {}
+        self.__semaphore = None
+
+    async def __aenter__(self):
+        api = self.__sync_api
+        timeout = aiohttp.ClientTimeout(sock_connect=api.CONNECT_TIMEOUT, sock_read=api.READ_TIMEOUT)
+        self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        for is_temp in (True, False):
+            header = api.header.copy()
+            header['Authorization'] += api.temp_org_api_key if is_temp else api.main_org_api_key
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=False)
+            self.__sessions[is_temp] = aiohttp.ClientSession(headers=header, timeout=timeout, connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        for session in self.__sessions.values():
+            await session.close()
+        self.__sessions = {}
+        return False
+
+    """
+    Sends one request to Grafana, waiting for a free concurrency slot first.  GET and DELETE requests are retried
+    with exponential backoff on connection errors and 502/503/504 responses.  The call is counted and timed as one
+    step however many attempts it takes
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        method: HTTP method
+        url: request url
+        json: request body
+
+    Returns: (status code, response JSON).  A response that is not JSON, such as an error page from a proxy, is
+    returned as {"message": body} so the caller still sees the real status
+    """
+    async def __request(self, is_temp, method, url, json=None):
+        Metrics.count_call("grafana", "async_" + method.lower())
+        with Metrics.timed("grafana.async_" + method.lower()):
+            return await self.__send(is_temp, method, url, json)
+
+    async def __send(self, is_temp, method, url, json):
+        retries = self.__sync_api.MAX_RETRIES if method in self.IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            try:
+                async with self.__semaphore:
+                    async with self.__sessions[is_temp].request(method, url, json=json) as r:
+                        if r.status not in self.RETRY_STATUSES or attempt >= retries:
+                            if method == 'GET' and "/api/dashboards/uid/" in url:
+                                Metrics.observe_payload("received", len(await r.read()))
+                            return r.status, await self.__read_json(r)
+            except aiohttp.ClientConnectionError:
+                if attempt >= retries:
+                    raise
+            await asyncio.sleep(self.__sync_api.RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+
+    @staticmethod
+    async def __read_json(r):
+        body = await r.text()
+        if r.content_type == 'application/json':
+            try:
+                return json_lib.loads(body)
+            except ValueError:
+                pass
+        return {"message": body}
+
+    """
+    Gets identification info of all dashboards
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        page: page of results to get, starting at 1.  All dashboards are returned if not given
+        limit: number of results per page
+
+    Returns: JSON of all dashboards info
+    """
+    async def get_dash_list(self, is_temp, page=None, limit=None):
+        url = self.__sync_api.SERVER + "/api/search?query=%"
+        if page is not None:
+            url += "&type=dash-db&page=" + str(page) + "&limit=" + str(limit)
+        _, dash_list = await self.__request(is_temp, 'GET', url)
+        return dash_list
+
+    """
+    Gets the JSON of a specified dashboard by uid
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        dash_uid: Target dash uid
+
+    Returns: JSON of target dashboard
+    """
+    async def get_dash_info_by_uid(self, is_temp, dash_uid):
+        _, dash = await self.__request(is_temp, 'GET', self.__sync_api.SERVER + "/api/dashboards/uid/" + dash_uid)
+        return dash
+
+    """
+    Gets the JSON of several dashboards concurrently
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        dash_uids: list of target dash uids
+
+    Returns: list of dashboard JSON in the same order as dash_uids
+    """
+    async def get_dashes(self, is_temp, dash_uids):
+        return await asyncio.gather(*[self.get_dash_info_by_uid(is_temp, uid) for uid in dash_uids])
+
+    """
+    Deletes target dashboard
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        uid: target dashboards uid
+
+    Returns: status code of the delete
+    """
+    async def delete_dash(self, is_temp, uid):
+        status, _ = await self.__request(is_temp, 'DELETE', self.__sync_api.SERVER + "/api/dashboards/uid/" + uid)
+        self.__sync_api.invalidate_dash(is_temp, uid)
+        if status in (200, 404):
+            self.__sync_api.update_dash_index(is_temp, uid)
+        return status
+
+    """
+    Deletes several dashboards concurrently
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        uids: list of target dashboard uids
+
+    Returns: dict of uid -> status code of its delete
+    """
+    async def delete_dashes(self, is_temp, uids):
+        statuses = await asyncio.gather(*[self.delete_dash(is_temp, uid) for uid in uids])
+        return dict(zip(uids, statuses))
+
+    """
+    Saves a dashboard with the version it was read at
+
+    Args:
+        is_temp: decides whether to use main org or temp org api key
+        dash: dashboard JSON as returned by get_dash_info_by_uid
+
+    Returns: (status code, response JSON)
+    """
+    async def save_dash(self, is_temp, dash):
+        payload = {
+            "dashboard": dash['dashboard'],
+            "overwrite": False
+        }
+        if 'folderId' in dash.get('meta', {}):
+            payload['folderId'] = dash['meta']['folderId']
+
+        status, info = await self.__request(is_temp, 'POST', self.__sync_api.url, json=payload)
+        if dash['dashboard'].get('uid') is not None:
+            self.__sync_api.invalidate_dash(is_temp, dash['dashboard']['uid'])
+        if status == 200:
+            self.__sync_api.update_dash_index(is_temp, info.get('uid', dash['dashboard'].get('uid')),
+                                              dash['dashboard']['title'])
+        return status, info
+
+    """
+    Copies panels from several temp org dashboards into several main org dashboards.  The source and target
+    dashboards are all fetched concurrently, every target gets its own copies with fresh ids laid out below its
+    panels, and every target is saved once.  A target changed by someone else in the meantime is fetched and copied
+    into once more
+
+    Args:
+        sources: dict of temp org dashboard uid -> list of panel ids to copy from it
+        target_uids: list of main org dashboard uids where panels will be copied to
+
+    Returns: dict of target uid -> (status code, response JSON) of its save
+    """
+    async def promote_panels(self, sources, target_uids):
+        source_uids = list(sources)
+        source_dashes = await self.get_dashes(True, source_uids)
+        panels = []
+        for source_uid, source_dash in zip(source_uids, source_dashes):
+            if 'dashboard' in source_dash:
+                panels += API_Processor.GrafanaAPIProcessor.select_panels(source_dash, sources[source_uid])
+
+        async def copy_to(target_uid):
+            for attempt in range(2):
+                target_dash = await self.get_dash_info_by_uid(False, target_uid)
+                if 'dashboard' not in target_dash:
+                    return 404, target_dash
+                API_Processor.GrafanaAPIProcessor.append_panels(target_dash, copy.deepcopy(panels))
+                status, info = await self.save_dash(False, target_dash)
+                if status != 412 or info.get('status') != 'version-mismatch':
+                    break
+            return status, info
+
+        results = await asyncio.gather(*[copy_to(target_uid) for target_uid in target_uids])
+        return dict(zip(target_uids, results))
+
+    """
+    Copies panels from several temp org dashboards into one main org dashboard
+
+    Args:
+        sources: dict of temp org dashboard uid -> list of panel ids to copy from it
+        target_uid: Main org dashboard uid where panels will be copied to
+
+    Returns: (status code, response JSON) of the save
+    """
+    async def copy_panels(self, sources, target_uid):
+        results = await self.promote_panels(sources, [target_uid])
+        return results[target_uid]
+
+
+"""
+Runs a coroutine to completion on a new event loop, for calling the processor from sync code
+
+Args:
+    coroutine: coroutine to run
+
+Returns: result of the coroutine
+"""
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
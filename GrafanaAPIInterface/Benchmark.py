@@ -0,0 +1,308 @@
+"""
+Benchmark
+Measures dashboard creation, panel insertion, temp graph updates, bulk deletes and reaper runs against the in-process
+fakes from Benchmark_Fakes, so no Grafana or Postgres is needed.  Every operation is timed and the Grafana round trips
+it made are counted, then p50/p99 latency and round trips per operation are reported for every scenario.
+
+Scenarios:
+    single_user     one user builds a temp dashboard through GrafanaAPIProcessor
+    routes          one user builds a temp dashboard through the Interface.py routes
+    concurrent      USERS users do the routes scenario at the same time
+    bulk_delete     delete many main org dashboards with AsyncGrafanaAPIProcessor
+    reaper          expire and reconcile many temp dashboards with TempDashReaper
+
+Usage:
+    python Benchmark.py                                 run every scenario
+    python Benchmark.py --scenario single_user routes   run some scenarios
+    python Benchmark.py --latency 5 --users 50          5 ms per Grafana request, 50 concurrent users
+    python Benchmark.py --json results.json             also write the results as JSON
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import argparse
+import asyncio
+import tempfile
+import threading
+import json
+import math
+import time
+import os
+import Benchmark_Fakes
+
+SCENARIOS = ('single_user', 'routes', 'concurrent', 'bulk_delete', 'reaper')
+
+
+"""
+Collects the latency and Grafana round trips of every timed operation
+
+Args:
+    grafana: FakeGrafana whose requests are counted
+"""
+class Recorder:
+    def __init__(self, grafana):
+        self.grafana = grafana
+        self.__lock = threading.Lock()
+        self.results = {}
+
+    """
+    Times the block as one operation of a scenario.  The round trips are the requests FakeGrafana answered while the
+    block ran, so they are exact for sequential scenarios and a share of the total for concurrent ones
+
+    Args:
+        scenario: scenario name
+        operation: operation name
+    """
+    @contextmanager
+    def timed(self, scenario, operation):
+        requests_before = self.grafana.request_count()
+        start = time.perf_counter()
+        yield
+        self.record(scenario, operation, time.perf_counter() - start, self.grafana.request_count() - requests_before)
+
+    """
+    Records one operation
+
+    Args:
+        scenario: scenario name
+        operation: operation name
+        elapsed: seconds the operation took
+        round_trips: Grafana requests the operation made
+    """
+    def record(self, scenario, operation, elapsed, round_trips):
+        with self.__lock:
+            self.results.setdefault(scenario, {}).setdefault(operation, []).append((elapsed, round_trips))
+
+    """
+    Summarizes every operation
+
+    Returns: dict of scenario -> operation -> {count, p50_ms, p99_ms, round_trips}
+    """
+    def summary(self):
+        output = {}
+        with self.__lock:
+            for scenario, operations in self.results.items():
+                for operation, samples in operations.items():
+                    latencies = sorted(elapsed for elapsed, _ in samples)
+                    output.setdefault(scenario, {})[operation] = {
+                        "count": len(samples),
+                        "p50_ms": percentile(latencies, 0.50) * 1000,
+                        "p99_ms": percentile(latencies, 0.99) * 1000,
+                        "round_trips": sum(round_trips for _, round_trips in samples) / len(samples)
+                    }
+        return output
+
+
+"""
+Gets a percentile of sorted values by nearest rank
+
+Args:
+    values: sorted list
+    fraction: percentile between 0 and 1
+
+Returns: value at the percentile
+"""
+def percentile(values, fraction):
+    return values[min(len(values), max(1, math.ceil(fraction * len(values)))) - 1]
+
+
+"""
+Points the repo's modules at the fakes.  Everything that writes to disk is redirected into work_dir, and the
+environment is set before the modules are imported because they read it at import time
+
+Args:
+    grafana: running FakeGrafana
+    fake_db: FakeEngineeringDB
+    work_dir: directory for the panel id index, expiry index and temp dash pool
+    pool_size: number of prefetched temp dashboards
+
+Returns: dict of the imported modules
+"""
+def setup_modules(grafana, fake_db, work_dir, pool_size):
+    panel_index = os.path.join(work_dir, "panel_id_index.txt")
+    with open(panel_index, 'w') as f:
+        f.write("0")
+    os.environ["PANEL_ID_INDEX_FILE"] = panel_index
+    os.environ["TEMP_DASH_EXPIRY_FILE"] = os.path.join(work_dir, "temp_dash_expiry.db")
+    os.environ["TEMP_DASH_POOL_FILE"] = os.path.join(work_dir, "temp_dash_expiry.db")
+    os.environ["TEMP_DASH_POOL_SIZE"] = str(pool_size)
+    os.environ.setdefault("ROLLUPS_ENABLED", "0")
+
+    import DB_Processor
+    DB_Processor.db().use_pool(fake_db)
+
+    import API_Processor
+    processor = API_Processor.GrafanaAPIProcessor
+    processor.SERVER = grafana.url
+    processor.url = grafana.url + '/api/dashboards/db'
+    processor.temp_org_api_key = Benchmark_Fakes.TEMP_ORG_KEY
+    processor.main_org_api_key = Benchmark_Fakes.MAIN_ORG_KEY
+
+    import Async_API_Processor
+    import Delete_Temp_Dashboards
+    import Expiry_Index
+    return {
+        "API_Processor": API_Processor,
+        "Async_API_Processor": Async_API_Processor,
+        "Delete_Temp_Dashboards": Delete_Temp_Dashboards,
+        "Expiry_Index": Expiry_Index
+    }
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def pick_tables(fake_db, user, count):
+    tables = sorted(fake_db.tables)
+    return [tables[(user * count + i) % len(tables)] for i in range(count)]
+
+
+"""
+One user builds a temp dashboard with graphs panels through GrafanaAPIProcessor
+"""
+def single_user(recorder, modules, fake_db, graphs):
+    api = modules["API_Processor"].GrafanaAPIProcessor()
+    with recorder.timed("single_user", "create_temp_dash"):
+        uid = api.create_temp_dash()
+
+    for i, table in enumerate(pick_tables(fake_db, 0, graphs)):
+        values = {"graph_name": "graph " + str(i), "table": [[table, "c00", "c01"]], "is_temp": True, "uid": uid}
+        with recorder.timed("single_user", "insert_new_panel"):
+            panel_id = api.insert_new_panel(values)
+        with recorder.timed("single_user", "update_temp_dash"):
+            api.update_temp_dash(uid, [{"id": panel_id, "tables": [{"table_name": table, "cols": ["c02", "c03"]}]}])
+        with recorder.timed("single_user", "update_y_min_max"):
+            api.update_y_min_max(True, panel_id, uid, "0", str(i + 10))
+        with recorder.timed("single_user", "update_dash_time"):
+            api.update_dash_time("now-" + str(i + 1) + "h", "now", True, uid)
+
+
+"""
+One user of the Interface.py routes: opens the page, makes graphs temp graphs and changes the time range
+"""
+def route_user(recorder, scenario, client, fake_db, user, graphs):
+    tables = pick_tables(fake_db, user, graphs)
+    with recorder.timed(scenario, "GET /temp_graphs"):
+        client.get('/temp_graphs')
+    with recorder.timed(scenario, "GET /cols"):
+        client.get('/cols?tables=' + ",".join(tables))
+    # c01x has a trigram no column contains, the search has to come back empty instead of failing
+    for query in ("c01", "c01x"):
+        with recorder.timed(scenario, "GET /search/columns"):
+            r = client.get('/search/columns?q=' + query)
+        if r.status_code != 200:
+            raise RuntimeError("GET /search/columns?q=" + query + " returned " + str(r.status_code))
+
+    uid = "null"
+    for i, table in enumerate(tables):
+        form = {"uid": uid, "updated": "false", "time_from": "now-6h", "time_to": "now",
+                "graph_name": "graph " + str(i), "boxes": [table + "c00", table + "c01"]}
+        with recorder.timed(scenario, "POST /temp_graphs (new graph)"):
+            r = client.post('/temp_graphs', data=form)
+        uid = r.headers['Location'].split('uid=')[-1].split('&')[0]
+
+    with recorder.timed(scenario, "POST /temp_graphs (time range)"):
+        client.post('/temp_graphs', data={"uid": uid, "updated": "false", "time_from": "now-12h", "time_to": "now"})
+
+
+def routes(recorder, fake_db, graphs):
+    import Interface
+    Interface.app.config['WTF_CSRF_ENABLED'] = False
+    route_user(recorder, "routes", Interface.app.test_client(), fake_db, 0, graphs)
+
+
+def concurrent(recorder, fake_db, graphs, users):
+    import Interface
+    Interface.app.config['WTF_CSRF_ENABLED'] = False
+    requests_before = recorder.grafana.request_count()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [executor.submit(route_user, recorder, "concurrent", Interface.app.test_client(), fake_db, user,
+                                   graphs) for user in range(users)]
+        for future in futures:
+            future.result()
+    recorder.record("concurrent", str(users) + " users (wall time)", time.perf_counter() - start,
+                    recorder.grafana.request_count() - requests_before)
+
+
+def bulk_delete(recorder, modules, grafana, count):
+    uids = [grafana.seed(False, {"title": "bulk " + str(i), "panels": []}) for i in range(count)]
+
+    async def delete():
+        async with modules["Async_API_Processor"].AsyncGrafanaAPIProcessor() as api:
+            return await api.delete_dashes(False, uids)
+
+    with recorder.timed("bulk_delete", "delete_dashes x" + str(count)):
+        run_async(delete())
+
+    api = modules["API_Processor"].GrafanaAPIProcessor()
+    for i in range(min(count, 20)):
+        uid = grafana.seed(False, {"title": "single " + str(i), "panels": []})
+        with recorder.timed("bulk_delete", "delete_dash"):
+            api.delete_dash(False, uid)
+
+
+def reaper(recorder, modules, grafana, count):
+    index = modules["Expiry_Index"].ExpiryIndex()
+    expired_at = time.time() - 60
+    for i in range(count):
+        index.add(grafana.seed(True, {"title": "expired " + str(i), "panels": []}), expired_at)
+    temp_dash_reaper = modules["Delete_Temp_Dashboards"].TempDashReaper(index)
+    with recorder.timed("reaper", "run_once x" + str(count)):
+        temp_dash_reaper.run_once()
+
+    idle_since = time.time() - index.TEMP_DASH_LIFETIME - 60
+    for i in range(count):
+        grafana.seed(True, {"title": "unindexed " + str(i), "panels": []}, updated=idle_since)
+    with recorder.timed("reaper", "reconcile x" + str(count)):
+        temp_dash_reaper.reconcile()
+
+
+def print_summary(summary):
+    print("%-14s %-34s %7s %10s %10s %12s" % ("scenario", "operation", "count", "p50 ms", "p99 ms", "round trips"))
+    for scenario, operations in summary.items():
+        for operation, stats in operations.items():
+            print("%-14s %-34s %7d %10.2f %10.2f %12.2f" % (scenario, operation, stats['count'], stats['p50_ms'],
+                                                            stats['p99_ms'], stats['round_trips']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the Grafana API processors and Interface.py routes")
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=2.0, help="fake Grafana latency per request in ms")
+    parser.add_argument('--db-latency', type=float, default=1.0, help="fake database latency per query in ms")
+    parser.add_argument('--users', type=int, default=50, help="users in the concurrent scenario")
+    parser.add_argument('--graphs', type=int, default=10, help="graphs every user makes")
+    parser.add_argument('--count', type=int, default=200, help="dashboards in the bulk delete and reaper scenarios")
+    parser.add_argument('--pool-size', type=int, default=0, help="prefetched temp dashboards, 0 turns the pool off")
+    parser.add_argument('--json', help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    with Benchmark_Fakes.FakeGrafana(latency=args.latency / 1000) as grafana, \
+            tempfile.TemporaryDirectory() as work_dir:
+        fake_db = Benchmark_Fakes.FakeEngineeringDB(latency=args.db_latency / 1000)
+        modules = setup_modules(grafana, fake_db, work_dir, args.pool_size)
+        recorder = Recorder(grafana)
+
+        if 'single_user' in args.scenario:
+            single_user(recorder, modules, fake_db, args.graphs)
+        if 'routes' in args.scenario:
+            routes(recorder, fake_db, args.graphs)
+        if 'concurrent' in args.scenario:
+            concurrent(recorder, fake_db, args.graphs, args.users)
+        if 'bulk_delete' in args.scenario:
+            bulk_delete(recorder, modules, grafana, args.count)
+        if 'reaper' in args.scenario:
+            reaper(recorder, modules, grafana, args.count)
+
+        summary = recorder.summary()
+        print_summary(summary)
+        if args.json is not None:
+            with open(args.json, 'w') as f:
+                json.dump({"args": vars(args), "grafana_requests": grafana.counts, "db_queries": fake_db.query_count,
+                           "results": summary}, f, indent=2)
@@ -0,0 +1,304 @@
+"""
+Benchmark Fakes
+In-process stand-ins for Grafana and smax_engdb used by Benchmark.py, so the benchmarks run without a live server.
+
+FakeGrafana is a threaded HTTP server implementing the parts of the Grafana API this app uses: saving dashboards
+(with version-mismatch checks), reading and deleting them by uid, and paged search.  The org of every request is
+picked from its API key.  Every request sleeps for the configured latency and is counted by method and route.
+
+FakeEngineeringDB implements the ConnectionPool interface used by DB_Processor and answers the titles, schema,
+version and prepared lookup queries from generated tables, with its own configurable latency.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from contextlib import contextmanager
+import datetime
+import threading
+import json
+import time
+import uuid
+
+TEMP_ORG_KEY = "benchmark-temp-key"
+MAIN_ORG_KEY = "benchmark-main-key"
+DASH_PREFIX = "/api/dashboards/uid/"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+"""
+Fake Grafana HTTP API
+
+Args:
+    latency: seconds every request sleeps before it is answered
+    port: port to listen on, 0 picks a free one
+"""
+class FakeGrafana:
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.__lock = threading.Lock()
+        self.__dashes = {True: {}, False: {}}
+        self.__next_id = 1
+        self.counts = {}
+        self.__server = _ThreadingHTTPServer(('127.0.0.1', port), self.__handler())
+        self.url = "http://127.0.0.1:" + str(self.__server.server_address[1])
+        self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    """
+    Starts serving in a background thread
+    """
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="fake-grafana", daemon=True)
+        self.__thread.start()
+
+    """
+    Stops the server
+    """
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    """
+    Gets the total number of requests answered so far
+
+    Returns: int
+    """
+    def request_count(self):
+        with self.__lock:
+            return sum(self.counts.values())
+
+    """
+    Gets the number of dashboards in an org
+
+    Args:
+        is_temp: temp org or main org
+
+    Returns: int
+    """
+    def dash_count(self, is_temp):
+        with self.__lock:
+            return len(self.__dashes[is_temp])
+
+    """
+    Creates or replaces a dashboard directly, without a request
+
+    Args:
+        is_temp: temp org or main org
+        dashboard: dashboard JSON, a uid is generated if it has none
+        updated: unix time the dashboard was last updated
+
+    Returns: uid of the dashboard
+    """
+    def seed(self, is_temp, dashboard, updated=None):
+        with self.__lock:
+            return self.__store(is_temp, dict(dashboard), updated)
+
+    def __store(self, is_temp, dashboard, updated=None):
+        uid = dashboard.get('uid') or uuid.uuid4().hex[:16]
+        old = self.__dashes[is_temp].get(uid)
+        dashboard['uid'] = uid
+        dashboard['id'] = old['dashboard']['id'] if old is not None else self.__next_id
+        dashboard['version'] = 1 if old is None else old['dashboard']['version'] + 1
+        self.__next_id += 1
+        updated = time.time() if updated is None else updated
+        created = updated if old is None else old['meta']['created']
+        self.__dashes[is_temp][uid] = {
+            "dashboard": dashboard,
+            "meta": {"created": created, "updated": updated, "folderId": 0}
+        }
+        return uid
+
+    @staticmethod
+    def __timestamp(unix_time):
+        return datetime.datetime.fromtimestamp(unix_time, datetime.timezone.utc).isoformat()
+
+    def __save(self, is_temp, body):
+        dashboard = body['dashboard']
+        with self.__lock:
+            old = self.__dashes[is_temp].get(dashboard.get('uid') or "")
+            if old is not None and not body.get('overwrite') \
+                    and dashboard.get('version') != old['dashboard']['version']:
+                return 412, {"status": "version-mismatch", "message": "The dashboard has been changed by someone else"}
+            uid = self.__store(is_temp, json.loads(json.dumps(dashboard)))
+            saved = self.__dashes[is_temp][uid]['dashboard']
+            return 200, {"id": saved['id'], "uid": uid, "version": saved['version'], "status": "success",
+                         "url": "/d/" + uid}
+
+    def __get(self, is_temp, uid):
+        with self.__lock:
+            dash = self.__dashes[is_temp].get(uid)
+            if dash is None:
+                return 404, {"message": "Dashboard not found"}
+            output = json.loads(json.dumps(dash))
+        output['meta']['created'] = self.__timestamp(output['meta']['created'])
+        output['meta']['updated'] = self.__timestamp(output['meta']['updated'])
+        return 200, output
+
+    def __delete(self, is_temp, uid):
+        with self.__lock:
+            dash = self.__dashes[is_temp].pop(uid, None)
+        if dash is None:
+            return 404, {"message": "Dashboard not found"}
+        return 200, {"title": dash['dashboard'].get('title')}
+
+    def __search(self, is_temp, query):
+        with self.__lock:
+            hits = [{"uid": uid, "title": dash['dashboard'].get('title'), "type": "dash-db"}
+                    for uid, dash in self.__dashes[is_temp].items()]
+        if 'page' in query:
+            limit = int(query['limit'][0])
+            start = (int(query['page'][0]) - 1) * limit
+            hits = hits[start:start + limit]
+        return 200, hits
+
+    def __route(self, method, path, query, is_temp, body):
+        if method == 'POST' and path == '/api/dashboards/db':
+            return '/api/dashboards/db', self.__save(is_temp, body)
+        if path.startswith(DASH_PREFIX) and method == 'GET':
+            return DASH_PREFIX, self.__get(is_temp, path[len(DASH_PREFIX):])
+        if path.startswith(DASH_PREFIX) and method == 'DELETE':
+            return DASH_PREFIX, self.__delete(is_temp, path[len(DASH_PREFIX):])
+        if method == 'GET' and path == '/api/search':
+            return '/api/search', self.__search(is_temp, query)
+        return path, (404, {"message": "Not found"})
+
+    """
+    Answers one request after sleeping for the latency, and counts it
+
+    Args:
+        method: HTTP method
+        path: request path
+        query: parsed query string
+        authorization: Authorization header, decides the org
+        body: parsed JSON body or None
+
+    Returns: (status code, response JSON)
+    """
+    def dispatch(self, method, path, query, authorization, body):
+        time.sleep(self.latency)
+        route, response = self.__route(method, path, query, authorization.endswith(TEMP_ORG_KEY), body)
+        with self.__lock:
+            key = method + " " + route
+            self.counts[key] = self.counts.get(key, 0) + 1
+        return response
+
+    def __handler(self):
+        grafana = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def __respond(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length > 0 else None
+                url = urlparse(self.path)
+                status, output = grafana.dispatch(method, url.path, parse_qs(url.query),
+                                                  self.headers.get('Authorization', ''), body)
+
+                data = json.dumps(output).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.__respond('GET')
+
+            def do_POST(self):
+                self.__respond('POST')
+
+            def do_DELETE(self):
+                self.__respond('DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+"""
+Fake smax_engdb with the ConnectionPool interface.  Generates tables t000000, t000001, ... each with a smaxvar name
+and columns c00, c01, ...
+
+Args:
+    table_count: number of tables
+    col_count: number of columns per table
+    latency: seconds every query sleeps
+"""
+class FakeEngineeringDB:
+    def __init__(self, table_count=500, col_count=20, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        for i in range(table_count):
+            self.tables["t%06d" % i] = ("sma:bench:var%d" % i, ["time"] + ["c%02d" % c for c in range(col_count)])
+        self.query_count = 0
+        self.__lock = threading.Lock()
+
+    def execute(self, sql, params=None, fetch="all"):
+        time.sleep(self.latency)
+        with self.__lock:
+            self.query_count += 1
+        sql = str(sql)
+        if "FROM titles" in sql:
+            rows = [(tabname, smaxvar) for tabname, (smaxvar, _) in self.tables.items()]
+            description = [("tabname",), ("smaxvar",)]
+        elif "INFORMATION_SCHEMA.COLUMNS" in sql:
+            rows = [(tabname, cols) for tabname, (_, cols) in self.tables.items()]
+            description = [("table_name",), ("columns",)]
+        elif "pg_class" in sql:
+            rows = [(len(self.tables), sum(len(cols) for _, cols in self.tables.values()), len(self.tables))]
+            description = [("count",), ("sum",), ("max",)]
+        elif "pg_stat_user_tables" in sql:
+            rows = [(len(self.tables),)]
+            description = [("version",)]
+        else:
+            raise NotImplementedError("query not supported by the fake database: " + sql)
+
+        if fetch == "one":
+            return rows[0], description
+        return (rows if fetch == "all" else None), description
+
+    def execute_prepared(self, name, statement, params=(), fetch="all"):
+        if name == "table_columns":
+            time.sleep(self.latency)
+            with self.__lock:
+                self.query_count += 1
+            entry = self.tables.get(params[0])
+            rows = [] if entry is None else [(col,) for col in entry[1]]
+            description = [("attname",)]
+        elif name.startswith("titles_by_"):
+            time.sleep(self.latency)
+            with self.__lock:
+                self.query_count += 1
+            field = 0 if name == "titles_by_tabname" else 1
+            rows = [(tabname, smaxvar) for tabname, (smaxvar, _) in self.tables.items()
+                    if (tabname, smaxvar)[field] == params[0]][:1]
+            description = [("tabname",), ("smaxvar",)]
+        else:
+            return self.execute(statement, params, fetch)
+
+        if fetch == "one":
+            return (rows[0] if len(rows) != 0 else None), description
+        return (rows if fetch == "all" else None), description
+
+    @contextmanager
+    def cursor(self):
+        raise NotImplementedError("the fake database only supports execute and execute_prepared")
+        yield
+
+    def close(self):
+        pass
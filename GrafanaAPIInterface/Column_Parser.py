@@ -0,0 +1,98 @@
+"""
+Column Parser
+Cols for each table are selected by checkboxes which are returned as a list when posted.  The functions here group
+that list into the structures the Grafana API Processor expects in a single pass, using dictionaries keyed by panel
+and table so every checkbox costs constant time no matter how many columns are selected.
+"""
+
+DELIMITER = '/'
+
+
+"""
+Splits a checkbox value made of a table name followed by a column name
+
+Args:
+    tablecol: checkbox value ex: t000005c05
+
+Returns: (table, col) ex: (t000005, c05)
+"""
+def split_tablecol(tablecol):
+    index = tablecol.find('c')
+    return tablecol[:index], tablecol[index:]
+
+
+"""
+Groups checkbox values by table, keeping the order tables and columns were first selected in
+
+Args:
+    cols: Preformatted list with names of tables and cols ex: t000005c05, t000008c04,...
+
+Returns: dict of table -> list of cols ex: {t000005: [c05, c06], t000008: [c04]}
+"""
+def group_cols(cols):
+    tables = {}
+    for c in cols:
+        table, col = split_tablecol(c)
+        tables.setdefault(table, []).append(col)
+    return tables
+
+
+"""
+Cols for each table are selected by checkboxes which are returned as a list when posted.
+The list has to be parsed into a string for the Grafana API
+
+Args:
+    cols: Preformatted list with names of tables and cols ex: t000005c05, t000008c04,...
+
+Returns: Formatted list that breaks up the names into a tablecol ex: t000001c02c04c05, t000052c00,c01,c05
+"""
+def parse_cols(cols):
+    return [[table] + table_cols for table, table_cols in group_cols(cols).items()]
+
+
+"""
+Cols for each panel are selected by checkboxes which are returned as a list when posted.
+The list is grouped into panel -> table -> cols
+
+Args:
+    cols: Preformatted list with names of panels, tables and cols ex: 435/t000005/c05, 456/t000008/c04,...
+
+Returns: Formatted list that breaks up the names into a dict for each panel with list of tables and cols.  Malformed
+values (missing a part or with a non-numeric panel id) are skipped
+"""
+def parse_update_temp(cols):
+    panels = {}
+    for c in cols:
+        parts = c.split(DELIMITER, 2)
+        if len(parts) != 3 or not parts[0].isdigit() or parts[1] == "" or parts[2] == "":
+            continue
+        panel_id, table, col = parts
+        panels.setdefault(panel_id, {}).setdefault(table, []).append(col)
+
+    output = []
+    for panel_id, tables in panels.items():
+        output.append({
+            "id": panel_id,
+            "tables": [{"table_name": table, "cols": table_cols} for table, table_cols in tables.items()]
+        })
+    return output
+
+
+"""
+Panels to copy are selected by checkboxes which are returned as a list when posted.
+The list is grouped by the dashboard the panels belong to
+
+Args:
+    panels: Preformatted list with dashboard uids and panel ids ex: kX3c9a/2, kX3c9a/5, Pq71bd/3,...
+
+Returns: dict of dashboard uid -> list of panel ids ex: {kX3c9a: [2, 5], Pq71bd: [3]}.  Malformed values (no uid
+or a non-numeric panel id) are skipped
+"""
+def parse_panel_sources(panels):
+    sources = {}
+    for p in panels:
+        uid, _, panel_id = p.rpartition(DELIMITER)
+        if uid == "" or not panel_id.isdigit():
+            continue
+        sources.setdefault(uid, []).append(int(panel_id))
+    return sources
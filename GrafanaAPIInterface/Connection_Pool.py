@@ -0,0 +1,246 @@
+"""
+Connection Pool
+ConnectionPool wraps a psycopg2 ThreadedConnectionPool for the SMA engineering database.  Connections are checked
+before they are handed out, broken connections are discarded and replaced, and queries that fail because the
+connection dropped are retried once on a fresh connection.  Cursors are handed out through a context manager so the
+connection goes back to the pool as soon as the query is finished.
+Lookups that run often go through execute_prepared, which prepares each named statement once per connection on the
+server and afterwards only sends its parameters, so the server reuses the plan instead of parsing and planning the
+query on every call.
+Connections are never shared between processes: a process forked after the pool was opened (such as a web server
+worker) leaves the inherited connections untouched and opens its own.
+"""
+
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.pool
+import psycopg2.errors
+import threading
+import time
+import os
+import Metrics
+
+
+class ConnectionPool:
+    MIN_CONNECTIONS = int(os.environ.get("DATABASE_POOL_MIN", 1))
+    MAX_CONNECTIONS = int(os.environ.get("DATABASE_POOL_MAX", 10))
+    HEALTH_CHECK_INTERVAL = int(os.environ.get("DATABASE_POOL_HEALTH_CHECK", 30))
+    RECONNECT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+    def __init__(self, min_connections=None, max_connections=None, **connect_args):
+        self.min_connections = self.MIN_CONNECTIONS if min_connections is None else min_connections
+        self.max_connections = self.MAX_CONNECTIONS if max_connections is None else max_connections
+        self.__connect_args = connect_args
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(self.max_connections)
+        self.__last_used = {}
+        self.__prepared = {}
+        self.__pool = None
+        self.__pid = os.getpid()
+        self.__inherited = []
+
+    """
+    Creates a pool for the engineering database from the DATABASE_* environment variables
+
+    Returns: new ConnectionPool
+    """
+    @classmethod
+    def from_env(cls):
+        return cls(user=os.environ.get("DATABASE_USER"),
+                   password=os.environ.get("DATABASE_PASS"),
+                   host=os.environ.get("DATABASE_HOST"),
+                   port=os.environ.get("DATABASE_PORT"),
+                   database='smax_engdb')
+
+    def __check_fork(self):
+        if self.__pid == os.getpid():
+            return
+        # the parent's connections share sockets with this process, closing them here would close them for the
+        # parent as well, so they are kept referenced and never used
+        if self.__pool is not None:
+            self.__inherited.append(self.__pool)
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(self.max_connections)
+        self.__last_used = {}
+        self.__prepared = {}
+        self.__pool = None
+        self.__pid = os.getpid()
+
+    def __get_pool(self):
+        if self.__pool is None:
+            with self.__lock:
+                if self.__pool is None:
+                    self.__pool = psycopg2.pool.ThreadedConnectionPool(self.min_connections, self.max_connections,
+                                                                       **self.__connect_args)
+        return self.__pool
+
+    """
+    Checks if a pooled connection is still usable.  Connections idle for longer than HEALTH_CHECK_INTERVAL are
+    pinged with SELECT 1
+
+    Args:
+        con: connection to check
+
+    Returns: True if the connection can be used
+    """
+    def __is_healthy(self, con):
+        if con.closed:
+            return False
+        if time.monotonic() - self.__last_used.get(id(con), 0) < self.HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1;")
+            con.rollback()
+            return True
+        except self.RECONNECT_ERRORS:
+            return False
+
+    def __discard(self, con):
+        self.__last_used.pop(id(con), None)
+        self.__prepared.pop(id(con), None)
+        try:
+            self.__get_pool().putconn(con, close=True)
+        except psycopg2.pool.PoolError:
+            pass
+
+    """
+    Borrows a healthy connection from the pool, waiting if all max_connections are in use
+
+    Returns: psycopg2 connection
+    """
+    def getconn(self):
+        self.__check_fork()
+        self.__slots.acquire()
+        try:
+            pool = self.__get_pool()
+            con = pool.getconn()
+            while not self.__is_healthy(con):
+                self.__discard(con)
+                con = pool.getconn()
+            return con
+        except BaseException:
+            self.__slots.release()
+            raise
+
+    """
+    Returns a borrowed connection to the pool
+
+    Args:
+        con: connection from getconn
+        broken: close the connection instead of reusing it
+    """
+    def putconn(self, con, broken=False):
+        try:
+            if broken or con.closed:
+                self.__discard(con)
+            else:
+                self.__last_used[id(con)] = time.monotonic()
+                self.__get_pool().putconn(con)
+        finally:
+            self.__slots.release()
+
+    """
+    Context manager that yields a cursor on a pooled connection.  The transaction is committed when the block
+    finishes, rolled back if it raises, and the connection is returned to the pool either way
+    """
+    @contextmanager
+    def cursor(self):
+        with self.__transaction() as con:
+            with con.cursor() as cur:
+                yield cur
+
+    @contextmanager
+    def __transaction(self):
+        con = self.getconn()
+        broken = False
+        try:
+            yield con
+            con.commit()
+        except psycopg2.errors.InvalidSqlStatementName:
+            # an OperationalError, but the connection itself is fine
+            con.rollback()
+            raise
+        except self.RECONNECT_ERRORS:
+            broken = True
+            raise
+        except BaseException:
+            con.rollback()
+            raise
+        finally:
+            self.putconn(con, broken)
+
+    """
+    Runs a query and fetches its results.  If the connection dropped the query is retried once on a new connection
+
+    Args:
+        sql: query to run
+        params: query parameters
+        fetch: "all", "one" or None
+
+    Returns: fetched rows and the cursor description
+    """
+    def execute(self, sql, params=None, fetch="all"):
+        Metrics.count_call("db", "execute")
+        for attempt in range(2):
+            try:
+                with self.cursor() as cur:
+                    cur.execute(sql, params)
+                    return self.__fetch(cur, fetch), cur.description
+            except self.RECONNECT_ERRORS:
+                if attempt == 1:
+                    raise
+
+    """
+    Runs a named statement as a server-side prepared statement.  The statement is prepared the first time it runs on
+    a connection and only executed with the new parameters afterwards.  If the connection dropped, or the server no
+    longer knows the statement, it is prepared and run again once
+
+    Args:
+        name: statement name, a fixed SQL identifier never built from user input
+        statement: query with $1, $2, ... placeholders
+        params: tuple of query parameters
+        fetch: "all", "one" or None
+
+    Returns: fetched rows and the cursor description
+    """
+    def execute_prepared(self, name, statement, params=(), fetch="all"):
+        Metrics.count_call("db", name)
+        placeholders = "" if len(params) == 0 else " (" + ", ".join(["%s"] * len(params)) + ")"
+        for attempt in range(2):
+            try:
+                with self.__transaction() as con:
+                    prepared = self.__prepared.setdefault(id(con), set())
+                    with con.cursor() as cur:
+                        if name not in prepared:
+                            cur.execute("PREPARE " + name + " AS " + statement)
+                            prepared.add(name)
+                        cur.execute("EXECUTE " + name + placeholders, params)
+                        return self.__fetch(cur, fetch), cur.description
+            except psycopg2.errors.InvalidSqlStatementName:
+                # the server dropped its prepared statements, ex: after DISCARD ALL
+                prepared.clear()
+                if attempt == 1:
+                    raise
+            except self.RECONNECT_ERRORS:
+                if attempt == 1:
+                    raise
+
+    @staticmethod
+    def __fetch(cur, fetch):
+        if fetch == "all":
+            return cur.fetchall()
+        if fetch == "one":
+            return cur.fetchone()
+        return None
+
+    """
+    Closes every connection in the pool
+    """
+    def close(self):
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.closeall()
+                self.__pool = None
+                self.__last_used.clear()
+                self.__prepared.clear()
@@ -1,46 +1,660 @@
 """
 Database Processor
 DB Processor handles queries to the SMA engineering database.  Uses psycopg2 to connect to the database
-and query required tables.
+and query required tables.  Connections come from a shared ConnectionPool so concurrent requests each get their own
+connection and cursors are returned to the pool as soon as the query finishes.
+The titles table (tabname <-> smaxvar) is loaded once into an in-memory TitlesCatalog and the columns of every table
+into a SchemaCache.  Both are refreshed in the background, so name translation, table searches and column lookups
+never query the database on the request path.  A ColumnIndex built from both finds columns across every table.
+The pool and caches are shared by every db instance in a process.  After a fork the caches keep their snapshots and
+restart their refresh threads in the new process, and the pool opens new connections.
 """
 
 import psycopg2
 import os
+import heapq
+import hashlib
+import Connection_Pool
+import Metrics
+import logging
+import threading
+import time
 
+logger = logging.getLogger(__name__)
 
+# Statements run through ConnectionPool.execute_prepared.  Names typed by users are only ever passed as parameters,
+# and exact matches on titles and the system catalog are answered from indexes
+STATEMENTS = {
+    "titles_by_tabname": "SELECT tabname, smaxvar FROM titles WHERE tabname = $1 LIMIT 1",
+    "titles_by_smaxvar": "SELECT tabname, smaxvar FROM titles WHERE smaxvar = $1 LIMIT 1",
+    "table_columns": "SELECT a.attname::text FROM pg_attribute a "
+                     "JOIN pg_class c ON c.oid = a.attrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+                     "WHERE c.relname = $1 AND c.relkind IN ('r', 'p', 'v', 'm') "
+                     "AND n.nspname NOT IN ('pg_catalog', 'information_schema') "
+                     "AND a.attnum > 0 AND NOT a.attisdropped ORDER BY a.attnum",
+    "schema_version": "SELECT count(*), coalesce(sum(relnatts), 0), coalesce(max(oid::bigint), 0) "
+                      "FROM pg_class WHERE relkind IN ('r', 'p', 'v', 'm')",
+    "titles_version": "SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables WHERE relname = 'titles'",
+}
+
+
+"""
+Base class for the in-memory caches of the engineering database.  The cache is loaded with load_rows, and a background
+thread polls load_version every CHECK_INTERVAL seconds and reloads it when the version changed or the snapshot is older
+than REFRESH_TTL.  Every refresh builds a complete new snapshot with build_snapshot and swaps it in with a single
+assignment, so readers never need a lock.
+
+Args:
+    load_rows: callable returning (column names, rows) to build the snapshot from
+    load_version: callable returning a value that changes whenever the source data changes
+    load_one: callable looking up a single entry in the database, for names missing from the snapshot
+"""
+class RefreshingCache:
+    REFRESH_TTL = int(os.environ.get("DB_CACHE_TTL", 3600))
+    CHECK_INTERVAL = int(os.environ.get("DB_CACHE_CHECK_INTERVAL", 60))
+    NAME = "db-cache"
+
+    def __init__(self, load_rows, load_version, load_one=None):
+        self.__load_rows = load_rows
+        self.__load_version = load_version
+        self.__load_one = load_one
+        self.__misses = set()
+        self.__refresh_lock = threading.Lock()
+        self.__snapshot = None
+        self.__version = None
+        self.__loaded_at = 0
+        self.__thread = None
+        self.__pid = os.getpid()
+
+    """
+    Starts the background thread which keeps the snapshot up to date.  Calling it again in a forked process starts
+    the thread there, since threads do not survive a fork.  A failed refresh is logged and the previous snapshot is
+    kept until the next check
+    """
+    def start(self):
+        if self.__pid != os.getpid():
+            self.__refresh_lock = threading.Lock()
+            self.__pid = os.getpid()
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__thread = threading.Thread(target=self.__refresh_loop, name=self.NAME, daemon=True)
+        self.__thread.start()
+
+    def __refresh_loop(self):
+        while True:
+            time.sleep(self.CHECK_INTERVAL)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("%s refresh failed, keeping previous snapshot", self.NAME)
+
+    """
+    Reloads the snapshot if the source data changed or the current snapshot expired
+
+    Args:
+        force: reload even if nothing changed
+
+    Returns: True if a new snapshot was loaded
+    """
+    def refresh(self, force=False):
+        with self.__refresh_lock:
+            version = self.__load_version()
+            expired = time.time() - self.__loaded_at > self.REFRESH_TTL
+            if not force and self.__snapshot is not None and not expired and version == self.__version:
+                return False
+
+            columns, rows = self.__load_rows()
+            self.__snapshot = self.build_snapshot(columns, rows)
+            self.__misses = set()
+            self.__version = version
+            self.__loaded_at = time.time()
+            return True
+
+    """
+    Gets the current snapshot, loading it first if nothing has been loaded yet
+
+    Returns: snapshot built by build_snapshot
+    """
+    def snapshot(self):
+        snapshot = self.__snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self.__snapshot
+        return snapshot
+
+    """
+    Looks up one entry that is missing from the snapshot directly in the database, ex: a table created since the
+    last refresh.  Entries that are not found are remembered until the next refresh, so repeated lookups of an unknown
+    name do not query the database every time.  Database errors are logged and treated as not found so lookups keep
+    working from the snapshot
+
+    Args:
+        args: arguments for load_one
+
+    Returns: result of load_one or None if there is no load_one, nothing was found or the lookup failed
+    """
+    def load_one(self, *args):
+        misses = self.__misses
+        if self.__load_one is None or args in misses:
+            return None
+        try:
+            result = self.__load_one(*args)
+        except psycopg2.Error:
+            logger.exception("%s lookup failed", self.NAME)
+            return None
+        if result is None:
+            misses.add(args)
+        return result
+
+    """
+    Builds the cache contents from freshly loaded rows
+
+    Args:
+        columns: column names of the rows
+        rows: rows returned by load_rows
+
+    Returns: new snapshot
+    """
+    def build_snapshot(self, columns, rows):
+        raise NotImplementedError
+
+
+"""
+In-memory copy of the titles table.  Holds exact-match dictionaries in both directions (tabname -> smaxvar and
+smaxvar -> tabname), a trigram index over the lowercased smaxvar names for substring searches and a list of the rows
+sorted by smaxvar for listing every table in order.
+"""
+class TitlesCatalog(RefreshingCache):
+    REFRESH_TTL = int(os.environ.get("TITLES_CATALOG_TTL", 3600))
+    CHECK_INTERVAL = int(os.environ.get("TITLES_CATALOG_CHECK_INTERVAL", 60))
+    NAME = "titles-catalog"
+    WORD_SEPARATORS = ":._- "
+
+    def build_snapshot(self, columns, rows):
+        tab_index = columns.index('tabname')
+        smax_index = columns.index('smaxvar')
+
+        rows = [tuple(row) for row in rows]
+        smaxvars = [str(row[smax_index]) for row in rows]
+        lower_smaxvars = [smaxvar.lower() for smaxvar in smaxvars]
+        tabnames = [str(row[tab_index]) for row in rows]
+
+        tab_to_smax = {}
+        smax_to_tab = {}
+        trigrams = {}
+        for i, (tabname, smaxvar, lower_smaxvar) in enumerate(zip(tabnames, smaxvars, lower_smaxvars)):
+            tab_to_smax.setdefault(tabname, smaxvar)
+            smax_to_tab.setdefault(smaxvar, tabname)
+            for j in range(len(lower_smaxvar) - 2):
+                trigrams.setdefault(lower_smaxvar[j:j + 3], set()).add(i)
+
+        return {
+            "rows": rows,
+            "smaxvars": smaxvars,
+            "lower_smaxvars": lower_smaxvars,
+            "tabnames": tabnames,
+            "tab_to_smax": tab_to_smax,
+            "smax_to_tab": smax_to_tab,
+            "trigrams": trigrams,
+            "sorted_smaxvars": sorted((smaxvar, i) for i, smaxvar in enumerate(smaxvars)),
+        }
+
+    """
+    Finds the indexes of all rows whose smaxvar contains search_key, in titles table order
+
+    Args:
+        snapshot: catalog snapshot to search
+        search_key: substring to search for
+        ignore_case: match search_key against the lowercased smaxvar names
+
+    Returns: list of row indexes
+    """
+    @staticmethod
+    def __substring_matches(snapshot, search_key, ignore_case=False):
+        if ignore_case:
+            search_key = search_key.lower()
+        smaxvars = snapshot['lower_smaxvars'] if ignore_case else snapshot['smaxvars']
+        if search_key == "":
+            return range(len(smaxvars))
+        if len(search_key) < 3:
+            return [i for i, smaxvar in enumerate(smaxvars) if search_key in smaxvar]
+
+        lower_key = search_key.lower()
+        candidates = None
+        for j in range(len(lower_key) - 2):
+            posting = snapshot['trigrams'].get(lower_key[j:j + 3])
+            if posting is None:
+                return []
+            candidates = posting if candidates is None else candidates & posting
+            if not candidates:
+                return []
+        return sorted(i for i in candidates if search_key in smaxvars[i])
+
+    """
+    Gets all rows of the titles table whose smaxvar contains search_key
+
+    Args:
+        search_key: substring to search for
+
+    Returns: list of titles rows
+    """
+    def search(self, search_key):
+        snapshot = self.snapshot()
+        rows = snapshot['rows']
+        return [rows[i] for i in self.__substring_matches(snapshot, search_key)]
+
+    """
+    Gets one page of the rows of the titles table whose smaxvar contains query, ignoring case.  Matches are ranked
+    exact match first, then prefix matches, then matches at the start of a name segment (after : . _ - or a space),
+    then any other substring match, and within a rank by match position, name length and name
+
+    Args:
+        query: substring to search for
+        page: page of results to get, starting at 1
+        limit: number of results per page
+
+    Returns: (total number of matches, list of (tabname, smaxvar) on the page)
+    """
+    def search_ranked(self, query, page=1, limit=20):
+        snapshot = self.snapshot()
+        tabnames = snapshot['tabnames']
+        offset = (page - 1) * limit
+        if query == "":
+            return len(tabnames), [(tabnames[i], smaxvar)
+                                   for smaxvar, i in snapshot['sorted_smaxvars'][offset:offset + limit]]
+
+        query = query.lower()
+        lower_smaxvars = snapshot['lower_smaxvars']
+        matches = self.__substring_matches(snapshot, query, ignore_case=True)
+
+        def rank(i):
+            name = lower_smaxvars[i]
+            position = name.find(query)
+            if name == query:
+                tier = 0
+            elif position == 0:
+                tier = 1
+            elif name[position - 1] in self.WORD_SEPARATORS:
+                tier = 2
+            else:
+                tier = 3
+            return tier, position, len(name), snapshot['smaxvars'][i]
+
+        ranked = heapq.nsmallest(offset + limit, matches, key=rank)
+        return len(matches), [(tabnames[i], snapshot['smaxvars'][i]) for i in ranked[offset:]]
+
+    """
+    Converts a tabname to its smaxvar.  Exact matches are a dictionary lookup, then an exact lookup in the database
+    for tables added since the last refresh, and anything else falls back to the first smaxvar whose tabname contains
+    search_key
+
+    Args:
+        search_key: target tabname
+
+    Returns: smaxvar name or None if not found
+    """
+    def tabname_to_smaxvar(self, search_key):
+        snapshot = self.snapshot()
+        smaxvar = snapshot['tab_to_smax'].get(search_key)
+        if smaxvar is None:
+            row = self.load_one('tabname', search_key)
+            if row is not None:
+                return row[1]
+            for i, tabname in enumerate(snapshot['tabnames']):
+                if search_key in tabname:
+                    return snapshot['smaxvars'][i]
+        return smaxvar
+
+    """
+    Converts a smaxvar to its tabname.  Exact matches are a dictionary lookup, then an exact lookup in the database
+    for tables added since the last refresh, and anything else falls back to the first tabname whose smaxvar contains
+    search_key
+
+    Args:
+        search_key: target smaxvar
+
+    Returns: tabname or None if not found
+    """
+    def smaxvar_to_tabname(self, search_key):
+        snapshot = self.snapshot()
+        tabname = snapshot['smax_to_tab'].get(search_key)
+        if tabname is None:
+            row = self.load_one('smaxvar', search_key)
+            if row is not None:
+                return row[0]
+            matches = self.__substring_matches(snapshot, search_key)
+            if len(matches) != 0:
+                return snapshot['tabnames'][matches[0]]
+        return tabname
+
+
+"""
+In-memory copy of the column names of every table in the database, loaded with a single query grouped by table.
+The cache is invalidated by a schema version built from the system catalog, so it is only reloaded after tables or
+columns are added or dropped.  Every table also gets an ETag which only changes when its columns change.
+"""
+class SchemaCache(RefreshingCache):
+    REFRESH_TTL = int(os.environ.get("SCHEMA_CACHE_TTL", 86400))
+    CHECK_INTERVAL = int(os.environ.get("SCHEMA_CACHE_CHECK_INTERVAL", 60))
+    NAME = "schema-cache"
+
+    def build_snapshot(self, columns, rows):
+        table_cols = {}
+        etags = {}
+        for table_name, cols in rows:
+            table_cols[table_name] = tuple(cols)
+            etags[table_name] = hashlib.sha1((table_name + ":" + ",".join(cols)).encode()).hexdigest()[:16]
+        return {
+            "columns": table_cols,
+            "etags": etags,
+        }
+
+    """
+    Gets the columns of a table.  A table missing from the cache is looked up in the system catalog in case it was
+    just created, the background refresh adds it to the cache later
+
+    Args:
+        table: target table
+
+    Returns: tuple of column names, empty if the table does not exist
+    """
+    def get_columns(self, table):
+        cols = self.snapshot()['columns'].get(table)
+        if cols is None:
+            cols = self.load_one(table)
+        return () if cols is None else cols
+
+    """
+    Gets the columns of several tables at once
+
+    Args:
+        tables: list of target tables
+
+    Returns: (dict of table -> list of column names, combined ETag of the requested tables)
+    """
+    def get_columns_batch(self, tables):
+        output = {}
+        for table in tables:
+            output[table] = list(self.get_columns(table))
+        etags = self.snapshot()['etags']
+        etag = hashlib.sha1(",".join(table + "=" + etags.get(table, "") for table in output).encode()).hexdigest()
+        return output, etag
+
+
+"""
+Index of every column of every table, for finding which tables hold a column without selecting tables one at a time.
+Built from the SchemaCache (INFORMATION_SCHEMA.COLUMNS) and joined with the TitlesCatalog when searching, so every
+match is a (tabname, smaxvar, column) triple and tables missing from titles are left out.  Column names are kept in a
+trigram index over their lowercased names, each pointing at the tables that have the column.  When the schema cache
+loads a new snapshot only the tables whose ETag changed are re-indexed.
+
+Args:
+    schema: SchemaCache the columns come from
+    catalog: TitlesCatalog the smaxvar names come from
+"""
+class ColumnIndex:
+    def __init__(self, schema, catalog):
+        self.__schema = schema
+        self.__catalog = catalog
+        self.__lock = threading.Lock()
+        self.__indexed_snapshot = None
+        self.__etags = {}
+        self.__table_cols = {}
+        self.__col_tables = {}
+        self.__trigrams = {}
+
+    def __add_col(self, col, table):
+        tables = self.__col_tables.get(col)
+        if tables is None:
+            tables = self.__col_tables[col] = set()
+            lower_col = col.lower()
+            for j in range(len(lower_col) - 2):
+                self.__trigrams.setdefault(lower_col[j:j + 3], set()).add(col)
+        tables.add(table)
+
+    def __remove_col(self, col, table):
+        tables = self.__col_tables[col]
+        tables.discard(table)
+        if len(tables) == 0:
+            del self.__col_tables[col]
+            lower_col = col.lower()
+            for j in range(len(lower_col) - 2):
+                posting = self.__trigrams[lower_col[j:j + 3]]
+                posting.discard(col)
+                if len(posting) == 0:
+                    del self.__trigrams[lower_col[j:j + 3]]
+
+    """
+    Brings the index up to date with the current schema cache snapshot, re-indexing only added, dropped and changed
+    tables.  Must be called with the lock held
+
+    Returns: number of tables re-indexed
+    """
+    def __sync(self):
+        snapshot = self.__schema.snapshot()
+        if snapshot is self.__indexed_snapshot:
+            return 0
+
+        etags = snapshot['etags']
+        changed = [table for table in self.__etags if etags.get(table) != self.__etags[table]]
+        changed += [table for table in etags if table not in self.__etags]
+        for table in changed:
+            for col in self.__table_cols.pop(table, ()):
+                self.__remove_col(col, table)
+            self.__etags.pop(table, None)
+            cols = snapshot['columns'].get(table)
+            if cols is not None:
+                for col in cols:
+                    self.__add_col(col, table)
+                self.__table_cols[table] = cols
+                self.__etags[table] = etags[table]
+        self.__indexed_snapshot = snapshot
+        return len(changed)
+
+    """
+    Brings the index up to date with the schema cache
+
+    Returns: number of tables re-indexed
+    """
+    def sync(self):
+        with self.__lock:
+            return self.__sync()
+
+    """
+    Finds the columns whose name contains query, ignoring case, in every table that is in titles.  Exact column
+    matches come first, then prefix matches, then any other substring match, and within a rank by column name and
+    smaxvar
+
+    Args:
+        query: substring of the column name
+        smaxvar: only return tables whose smaxvar contains this, ignoring case
+        limit: maximum number of matches returned
+
+    Returns: (total number of matches, list of (tabname, smaxvar, column))
+    """
+    def search(self, query, smaxvar="", limit=100):
+        query = query.lower()
+        smaxvar = smaxvar.lower()
+        tab_to_smax = self.__catalog.snapshot()['tab_to_smax']
+        if smaxvar != "":
+            tab_to_smax = {table: name for table, name in tab_to_smax.items() if smaxvar in name.lower()}
+        with self.__lock:
+            self.__sync()
+            if len(query) < 3:
+                cols = [col for col in self.__col_tables if query in col.lower()]
+            else:
+                candidates = None
+                for j in range(len(query) - 2):
+                    posting = self.__trigrams.get(query[j:j + 3], frozenset())
+                    candidates = set(posting) if candidates is None else candidates & posting
+                    if not candidates:
+                        break
+                cols = [col for col in candidates if query in col.lower()]
+            matches = [(table, tab_to_smax[table], col) for col in cols for table in self.__col_tables[col]
+                       if table in tab_to_smax]
+
+        def rank(match):
+            col = match[2].lower()
+            return 0 if col == query else 1 if col.startswith(query) else 2, match[2], match[1]
+
+        return len(matches), heapq.nsmallest(limit, matches, key=rank)
+
+
+@Metrics.instrumented()
 class db:
-    __con = psycopg2.connect(user=os.environ.get("DATABASE_USER"),
-                             password=os.environ.get("DATABASE_PASS"),
-                             host=os.environ.get("DATABASE_HOST"),
-                             port=os.environ.get("DATABASE_PORT"),
-                             database='smax_engdb')
+    __pool = None
+    __catalog = None
+    __schema = None
+    __column_index = None
+    __lock = threading.RLock()
+    __pid = os.getpid()
+
+    def __check_fork(self):
+        if db.__pid == os.getpid():
+            return
+        db.__pid = os.getpid()
+        db.__lock = threading.RLock()
+        db.__column_index = None
+        for cache in (db.__catalog, db.__schema):
+            if cache is not None:
+                cache.start()
+
+    """
+    Gets the connection pool shared by every db instance, creating it on first use
+
+    Returns: ConnectionPool for smax_engdb
+    """
+    def get_pool(self):
+        self.__check_fork()
+        if db.__pool is None:
+            with db.__lock:
+                if db.__pool is None:
+                    db.__pool = Connection_Pool.ConnectionPool.from_env()
+        return db.__pool
+
+    """
+    Replaces the shared connection pool, for example with a fake database in Benchmark.py.  The caches are dropped
+    so they are loaded from the new pool on their next use
+
+    Args:
+        pool: object with the ConnectionPool interface
     """
-    Gets all columns for a target table in titles table 
-    
+    def use_pool(self, pool):
+        with db.__lock:
+            db.__pool = pool
+            db.__catalog = None
+            db.__schema = None
+            db.__column_index = None
+
+    """
+    Gets the shared titles catalog, loading it and starting its background refresh on first use
+
+    Returns: TitlesCatalog for the titles table
+    """
+    def get_catalog(self):
+        self.__check_fork()
+        if db.__catalog is None:
+            with db.__lock:
+                if db.__catalog is None:
+                    catalog = TitlesCatalog(self.__load_titles, self.__load_titles_version, self.__load_title)
+                    catalog.refresh(force=True)
+                    catalog.start()
+                    db.__catalog = catalog
+        return db.__catalog
+
+    """
+    Gets the shared schema cache, loading every table's columns and starting its background refresh on first use
+
+    Returns: SchemaCache for smax_engdb
+    """
+    def get_schema_cache(self):
+        self.__check_fork()
+        if db.__schema is None:
+            with db.__lock:
+                if db.__schema is None:
+                    schema = SchemaCache(self.__load_schema, self.__load_schema_version, self.__load_table_columns)
+                    schema.refresh(force=True)
+                    schema.start()
+                    db.__schema = schema
+        return db.__schema
+
+    """
+    Gets the shared column index, building it from the schema cache and titles catalog on first use
+
+    Returns: ColumnIndex over every table in titles
+    """
+    def get_column_index(self):
+        self.__check_fork()
+        if db.__column_index is None:
+            with db.__lock:
+                if db.__column_index is None:
+                    index = ColumnIndex(self.get_schema_cache(), self.get_catalog())
+                    index.sync()
+                    db.__column_index = index
+        return db.__column_index
+
+    def __load_schema(self):
+        rows, description = self.get_pool().execute(
+            "SELECT table_name, array_agg(column_name::text ORDER BY ordinal_position) "
+            "FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE table_schema NOT IN ('pg_catalog', 'information_schema') GROUP BY table_name;")
+        return [column[0] for column in description], rows
+
+    def __load_schema_version(self):
+        return self.__execute_prepared("schema_version", (), fetch="one")[0]
+
+    def __load_table_columns(self, table):
+        rows, _ = self.__execute_prepared("table_columns", (table,))
+        return None if len(rows) == 0 else tuple(row[0] for row in rows)
+
+    def __load_titles(self):
+        rows, description = self.get_pool().execute("SELECT * FROM titles;")
+        columns = [column[0] for column in description]
+        return columns, rows
+
+    def __load_titles_version(self):
+        return self.__execute_prepared("titles_version", (), fetch="one")[0]
+
+    def __load_title(self, column, value):
+        return self.__execute_prepared("titles_by_" + column, (value,), fetch="one")[0]
+
+    def __execute_prepared(self, name, params, fetch="all"):
+        return self.get_pool().execute_prepared(name, STATEMENTS[name], params, fetch)
+
+    """
+    Gets all columns for a target table in titles table
+
     Args:
         search_key: target table
-        
+
     Returns: All columns in target table
     """
     def get_tables(self, search_key):
-        cur = self.__con.cursor()
-        cur.execute("SELECT * FROM titles WHERE smaxvar LIKE \'%" + search_key + "%\';")
-        rows = cur.fetchall()
-        return rows
+        return self.get_catalog().search(search_key)
+
+    """
+    Searches the titles table by smaxvar, ranked and paginated
+
+    Args:
+        query: substring of the smaxvar, ignoring case
+        page: page of results to get, starting at 1
+        limit: number of results per page
+
+    Returns: (total number of matches, list of (tabname, smaxvar) on the page)
+    """
+    def search_tables(self, query, page, limit):
+        return self.get_catalog().search_ranked(query, page, limit)
 
     """
         Converts the given smaxvar table name into it's related tabname from the titles table
-        
+
         Args:
             search_key: target table
 
         Returns: Targets related tabname
     """
     def convert_smaxvar_to_tabname(self, search_key):
-        cur = self.__con.cursor()
-        cur.execute("SELECT tabname FROM titles WHERE smaxvar LIKE \'%" + search_key + "%\';")
-        rows = cur.fetchone()
-        return str(rows)
+        return str(self.get_catalog().smaxvar_to_tabname(search_key))
 
     """
     Converts the given tabname table name into it's related smaxvar from the titles table
@@ -51,10 +665,20 @@ class db:
     Returns: Targets related smaxvar name
     """
     def convert_tabname_to_smaxvar(self, search_key):
-        cur = self.__con.cursor()
-        cur.execute("SELECT smaxvar FROM titles WHERE tabname LIKE \'%" + search_key + "%\';")
-        rows = cur.fetchone()
-        return str(rows)[2:len(rows)-4]
+        return str(self.get_catalog().tabname_to_smaxvar(search_key))
+
+    """
+    Searches the columns of every table in titles by name
+
+    Args:
+        query: substring of the column name, ignoring case
+        smaxvar: only return tables whose smaxvar contains this, ignoring case
+        limit: maximum number of matches returned
+
+    Returns: (total number of matches, list of (tabname, smaxvar, column))
+    """
+    def search_columns(self, query, smaxvar, limit):
+        return self.get_column_index().search(query, smaxvar, limit)
 
     """
     Gets all columns in the specified table
@@ -65,7 +689,15 @@ class db:
     Returns: array of columns in target table
    """
     def get_col(self, search_key):
-        cur = self.__con.cursor()
-        cur.execute("SELECT Column_name FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = \'" + search_key + "\';")
-        rows = cur.fetchall()
-        return rows
+        return [(col,) for col in self.get_schema_cache().get_columns(search_key)]
+
+    """
+    Gets all columns of several tables at once
+
+    Args:
+        tables: list of target tables
+
+    Returns: (dict of table -> list of columns, ETag for the result)
+    """
+    def get_cols(self, tables):
+        return self.get_schema_cache().get_columns_batch(tables)
@@ -0,0 +1,208 @@
+"""
+Dashboard Index
+DashboardIndex keeps the uid and title of every dashboard in one org in memory, so the dashboard dropdowns and name
+lookups do not search Grafana on every page load.  Lookups by uid and by exact title are dictionary lookups, and a
+list of lowercased titles kept in sorted order answers prefix searches with bisect.
+A background thread syncs the index with Grafana search every SYNC_INTERVAL seconds and applies only the difference
+(added, removed and renamed dashboards).  Dashboards saved or deleted through this app are put into or removed from
+the index right away, and writes made while a sync is running are replayed on top of its result.
+"""
+
+import bisect
+import logging
+import threading
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Args:
+    list_page: callable (page, limit) returning one page of Grafana search results for the org
+    name: name of the background sync thread
+"""
+class DashboardIndex:
+    SYNC_INTERVAL = int(os.environ.get("DASH_INDEX_SYNC_INTERVAL", 60))
+    PAGE_SIZE = int(os.environ.get("DASH_INDEX_PAGE_SIZE", 5000))
+
+    def __init__(self, list_page, name="dash-index"):
+        self.__list_page = list_page
+        self.name = name
+        self.__lock = threading.Lock()
+        self.__sync_lock = threading.Lock()
+        self.__start_lock = threading.Lock()
+        self.__titles = {}
+        self.__uids_by_title = {}
+        self.__sorted_titles = []
+        self.__loaded = False
+        self.__writes = None
+        self.__thread = None
+        self.synced_at = 0
+
+    """
+    Starts the background thread which keeps the index in sync with Grafana.  Calling it again in a forked process
+    starts the thread there
+    """
+    def start(self):
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        with self.__start_lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__sync_loop, name=self.name, daemon=True)
+                self.__thread.start()
+
+    def __sync_loop(self):
+        while True:
+            time.sleep(self.SYNC_INTERVAL)
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("%s sync failed, keeping previous index", self.name)
+
+    def __list_all(self):
+        titles = {}
+        page = 1
+        while True:
+            dash_list = self.__list_page(page, self.PAGE_SIZE)
+            for dash in dash_list:
+                titles[dash['uid']] = dash['title']
+            if len(dash_list) < self.PAGE_SIZE:
+                return titles
+            page += 1
+
+    def __add(self, uid, title):
+        self.__titles[uid] = title
+        self.__uids_by_title.setdefault(title, uid)
+        bisect.insort(self.__sorted_titles, (title.lower(), title, uid))
+
+    def __remove(self, uid):
+        title = self.__titles.pop(uid, None)
+        if title is None:
+            return
+        entry = (title.lower(), title, uid)
+        i = bisect.bisect_left(self.__sorted_titles, entry)
+        if i < len(self.__sorted_titles) and self.__sorted_titles[i] == entry:
+            del self.__sorted_titles[i]
+        if self.__uids_by_title.get(title) == uid:
+            del self.__uids_by_title[title]
+            for other_uid in self.__uids_with_title(title):
+                self.__uids_by_title[title] = other_uid
+                break
+
+    def __uids_with_title(self, title):
+        key = title.lower()
+        i = bisect.bisect_left(self.__sorted_titles, (key,))
+        while i < len(self.__sorted_titles) and self.__sorted_titles[i][0] == key:
+            if self.__sorted_titles[i][1] == title:
+                yield self.__sorted_titles[i][2]
+            i += 1
+
+    def __apply(self, uid, title):
+        if self.__titles.get(uid) == title:
+            return False
+        self.__remove(uid)
+        if title is not None:
+            self.__add(uid, title)
+        return True
+
+    """
+    Lists every dashboard from Grafana search and applies the difference to the index
+
+    Returns: number of dashboards added, removed or renamed
+    """
+    def sync(self):
+        with self.__sync_lock:
+            with self.__lock:
+                self.__writes = {}
+            try:
+                titles = self.__list_all()
+            finally:
+                with self.__lock:
+                    writes, self.__writes = self.__writes, None
+            titles.update(writes)
+
+            with self.__lock:
+                changes = 0
+                for uid in [uid for uid in self.__titles if uid not in titles]:
+                    self.__remove(uid)
+                    changes += 1
+                for uid, title in titles.items():
+                    if self.__apply(uid, title):
+                        changes += 1
+                self.__loaded = True
+                self.synced_at = time.time()
+            return changes
+
+    def __ensure_loaded(self):
+        if not self.__loaded:
+            self.sync()
+
+    """
+    Records a dashboard saved by this app
+
+    Args:
+        uid: dashboard uid
+        title: dashboard title
+    """
+    def put(self, uid, title):
+        with self.__lock:
+            self.__apply(uid, title)
+            if self.__writes is not None:
+                self.__writes[uid] = title
+
+    """
+    Records a dashboard deleted by this app
+
+    Args:
+        uid: dashboard uid
+    """
+    def remove(self, uid):
+        with self.__lock:
+            self.__remove(uid)
+            if self.__writes is not None:
+                self.__writes[uid] = None
+
+    """
+    Gets the uid of the dashboard with a title.  Titles are only unique within a folder, the first match is returned
+
+    Args:
+        title: exact dashboard title
+
+    Returns: uid or None if no dashboard has that title
+    """
+    def get_uid(self, title):
+        self.__ensure_loaded()
+        with self.__lock:
+            return self.__uids_by_title.get(title)
+
+    """
+    Gets the dashboards whose title starts with prefix, ignoring case, sorted by title
+
+    Args:
+        prefix: start of the title
+        limit: maximum number of dashboards to return, None for all
+
+    Returns: list of (uid, title)
+    """
+    def search_prefix(self, prefix, limit=None):
+        self.__ensure_loaded()
+        key = prefix.lower()
+        output = []
+        with self.__lock:
+            i = bisect.bisect_left(self.__sorted_titles, (key,))
+            while i < len(self.__sorted_titles) and (limit is None or len(output) < limit):
+                lower_title, title, uid = self.__sorted_titles[i]
+                if not lower_title.startswith(key):
+                    break
+                output.append((uid, title))
+                i += 1
+        return output
+
+    """
+    Gets every dashboard in the index
+
+    Returns: list of (uid, title) sorted by title
+    """
+    def all(self):
+        return self.search_prefix("")
@@ -1,42 +1,185 @@
-import csv
-from tempfile import NamedTemporaryFile
-import shutil
-import API_Processor
-import datetime
+"""
+Delete Temp Dashboards
+Reaper for temporary dashboards in the temp org.  create_temp_dash records every temp dashboard in the ExpiryIndex
+with its deadline.  The reaper sleeps until the next deadline, then deletes every expired dashboard in concurrent
+batches through the Grafana API and removes them from the index.
+Reconciliation pages through every dashboard in the temp org instead of trusting the index, deletes the ones that
+have not been updated within the retention window and adds the others to the index, so dashboards whose creation
+was never recorded are cleaned up as well.  Dashboards waiting in the Temp Dash Pool are skipped.  The refill thread
+can add to the pool at any time, so pool membership is read again right before every batch is deleted or indexed.
+
+Usage:
+    python Delete_Temp_Dashboards.py                run as a daemon
+    python Delete_Temp_Dashboards.py --once         delete everything that expired and exit
+    python Delete_Temp_Dashboards.py --reconcile    reconcile the temp org against Grafana search first
+    python Delete_Temp_Dashboards.py --import-logs  import the old CSV temp dashboard logs into the index first
+"""
+
+import argparse
+import asyncio
+import logging
 import time
+import os
+from dateutil import parser as date_parser
+import Async_API_Processor
+import Expiry_Index
+import Temp_Dash_Pool
 
-EVEN_LOG_NAMAE = 'temp_dash_log_even.csv'
-ODD_LOG_NAME = 'temp_dash_log_odd.csv'
-log_file = ""
-DAY_SEC = 86400
-api = API_Processor.GrafanaAPIProcessor()
+LEGACY_LOG_NAMES = ['temp_dash_log.csv', 'temp_dash_log_even.csv', 'temp_dash_log_odd.csv']
+BATCH_SIZE = int(os.environ.get("REAPER_BATCH_SIZE", 50))
+MAX_SLEEP = int(os.environ.get("REAPER_MAX_SLEEP", 3600))
+RECONCILE_INTERVAL = int(os.environ.get("REAPER_RECONCILE_INTERVAL", 86400))
+SEARCH_PAGE_SIZE = int(os.environ.get("REAPER_SEARCH_PAGE_SIZE", 500))
+RETRY_INTERVAL = int(os.environ.get("REAPER_RETRY_INTERVAL", 60))
 
-while True:
-    temp_log = NamedTemporaryFile(mode='w', delete=False)
-    if int(datetime.datetime.now().strftime('%d')) % 2 == 0:
-        log_file = EVEN_LOG_NAMAE
-    else:
-        log_file = ODD_LOG_NAME
-    print(log_file)
+logger = logging.getLogger(__name__)
+
+
+"""
+Deletes expired temp dashboards in batches
+
+Args:
+    index: ExpiryIndex holding the temp dashboard deadlines
+    batch_size: number of dashboards deleted concurrently
+    pool: TempDashPool whose dashboards are never deleted
+"""
+class TempDashReaper:
+    def __init__(self, index=None, batch_size=BATCH_SIZE, pool=None):
+        self.index = Expiry_Index.ExpiryIndex() if index is None else index
+        self.batch_size = batch_size
+        self.pool = Temp_Dash_Pool.TempDashPool() if pool is None else pool
+
+    async def __delete_expired(self):
+        deleted = []
+        async with Async_API_Processor.AsyncGrafanaAPIProcessor(max_concurrency=self.batch_size) as api:
+            while True:
+                uids = self.index.expired(limit=self.batch_size)
+                if len(uids) == 0:
+                    break
+                # a pooled dashboard gets a new deadline when it is handed out
+                pooled = self.pool.all()
+                self.index.remove([uid for uid in uids if uid in pooled])
+                uids = [uid for uid in uids if uid not in pooled]
+                if len(uids) == 0:
+                    continue
+                statuses = await api.delete_dashes(True, uids)
+                done = [uid for uid, status in statuses.items() if status in (200, 404)]
+                self.index.remove(done)
+                deleted += done
+                if len(done) != len(uids):
+                    break
+        return deleted
+
+    async def __reconcile(self):
+        retention = self.index.TEMP_DASH_LIFETIME
+        known = self.index.all()
+        deleted = []
+        async with Async_API_Processor.AsyncGrafanaAPIProcessor(max_concurrency=self.batch_size) as api:
+            uids = []
+            page = 1
+            while True:
+                dash_list = await api.get_dash_list(True, page=page, limit=SEARCH_PAGE_SIZE)
+                uids += [dash['uid'] for dash in dash_list]
+                if len(dash_list) < SEARCH_PAGE_SIZE:
+                    break
+                page += 1
 
-    with open(log_file, newline='') as read_log, temp_log:
-        log_reader = csv.reader(read_log, delimiter=',')
-        log_writer = csv.writer(temp_log, delimiter=',')
-        for row in log_reader:
-            if len(row) != 0:
-                print(row[1])
-                calc_time = row[1]
-                time_obj = datetime.datetime.strptime(calc_time, '%Y-%m-%d %H:%M:%S.%f')
-                tdelta = datetime.datetime.now() - time_obj
+            for start in range(0, len(uids), self.batch_size):
+                batch = uids[start:start + self.batch_size]
+                dashes = await api.get_dashes(True, batch)
+                pooled = self.pool.all()
+                expired = []
+                for uid, dash in zip(batch, dashes):
+                    if uid in pooled:
+                        continue
+                    meta = dash.get('meta', {})
+                    last_used = meta.get('updated') or meta.get('created')
+                    if last_used is None:
+                        continue
+                    expires_at = date_parser.isoparse(last_used).timestamp() + retention
+                    if expires_at <= time.time():
+                        expired.append(uid)
+                    elif uid not in known:
+                        self.index.add(uid, expires_at)
 
-                if tdelta.days > 7:
-                    api.delete_dash(True, row[0])
-                else:
-                    log_writer.writerow(row)
-        shutil.move(temp_log.name, log_file)
+                if len(expired) != 0:
+                    statuses = await api.delete_dashes(True, expired)
+                    done = [uid for uid, status in statuses.items() if status in (200, 404)]
+                    self.index.remove(done)
+                    deleted += done
+        return deleted
 
-    time.sleep(DAY_SEC)
+    """
+    Pages through every dashboard in the temp org and deletes the ones idle for longer than the retention window.
+    Dashboards that are still in use but missing from the index are added to it
 
+    Returns: list of deleted uids
+    """
+    def reconcile(self):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.__reconcile())
+        finally:
+            loop.close()
 
+    """
+    Deletes every dashboard whose deadline has passed.  Dashboards that are already gone from Grafana are removed
+    from the index as well, failed deletes stay in the index and are retried on the next run
 
+    Returns: list of deleted uids
+    """
+    def run_once(self):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.__delete_expired())
+        finally:
+            loop.close()
 
+    """
+    Runs forever, waking at the next deadline (or after MAX_SLEEP seconds) to delete expired dashboards.  The temp
+    org is reconciled against Grafana search every RECONCILE_INTERVAL seconds.  A failed run (Grafana or the index
+    unavailable) is logged and retried after RETRY_INTERVAL seconds
+    """
+    def run_forever(self):
+        last_reconcile = time.time()
+        while True:
+            try:
+                if time.time() - last_reconcile >= RECONCILE_INTERVAL:
+                    deleted = self.reconcile()
+                    if len(deleted) != 0:
+                        print("reconcile deleted " + str(len(deleted)) + " temp dashboards")
+                    last_reconcile = time.time()
+
+                deleted = self.run_once()
+                if len(deleted) != 0:
+                    print("deleted " + str(len(deleted)) + " temp dashboards")
+
+                next_deadline = self.index.next_deadline()
+                sleep_time = MAX_SLEEP if next_deadline is None else next_deadline - time.time()
+            except Exception:
+                logger.exception("temp dashboard reaper run failed")
+                sleep_time = RETRY_INTERVAL
+            time.sleep(min(max(sleep_time, 1), MAX_SLEEP))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deletes expired temp dashboards")
+    parser.add_argument('--once', action='store_true', help="delete expired dashboards once and exit")
+    parser.add_argument('--import-logs', action='store_true', help="import the old CSV temp dashboard logs")
+    parser.add_argument('--reconcile', action='store_true', help="reconcile the temp org against Grafana search")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="dashboards deleted concurrently")
+    args = parser.parse_args()
+
+    reaper = TempDashReaper(batch_size=args.batch_size)
+    if args.import_logs:
+        for log_name in LEGACY_LOG_NAMES:
+            if os.path.exists(log_name):
+                print(log_name + ": imported " + str(reaper.index.import_log(log_name)))
+
+    if args.reconcile:
+        print("reconcile deleted " + str(len(reaper.reconcile())) + " temp dashboards")
+
+    if args.once:
+        print("deleted " + str(len(reaper.run_once())) + " temp dashboards")
+    else:
+        reaper.run_forever()
@@ -0,0 +1,114 @@
+"""
+Expiry Index
+ExpiryIndex records when every temp dashboard expires.  Entries are stored in a SQLite table indexed by their
+deadline, so the reaper can ask for the next deadline or for every expired dashboard without reading the whole log.
+A new connection is opened for every operation, which keeps the index safe to use from several threads and
+processes at once.
+"""
+
+from contextlib import contextmanager
+import sqlite3
+import csv
+import datetime
+import time
+import os
+
+
+class ExpiryIndex:
+    INDEX_FILE = os.environ.get("TEMP_DASH_EXPIRY_FILE", "temp_dash_expiry.db")
+    TEMP_DASH_LIFETIME = int(os.environ.get("TEMP_DASH_LIFETIME", 7 * 86400))
+
+    def __init__(self, index_file=None):
+        self.index_file = self.INDEX_FILE if index_file is None else index_file
+        with self.__connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS temp_dash (uid TEXT PRIMARY KEY, expires_at REAL NOT NULL);")
+            con.execute("CREATE INDEX IF NOT EXISTS temp_dash_expires_at ON temp_dash (expires_at);")
+
+    @contextmanager
+    def __connect(self):
+        con = sqlite3.connect(self.index_file, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    """
+    Adds a dashboard to the index or moves its deadline
+
+    Args:
+        uid: temp dashboard uid
+        expires_at: unix time the dashboard expires, defaults to TEMP_DASH_LIFETIME from now
+    """
+    def add(self, uid, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + self.TEMP_DASH_LIFETIME
+        with self.__connect() as con:
+            con.execute("INSERT OR REPLACE INTO temp_dash (uid, expires_at) VALUES (?, ?);", (uid, expires_at))
+
+    """
+    Gets the dashboards whose deadline has passed, earliest first
+
+    Args:
+        now: unix time to compare deadlines with, defaults to the current time
+        limit: maximum number of dashboards to return
+
+    Returns: list of uids
+    """
+    def expired(self, now=None, limit=None):
+        if now is None:
+            now = time.time()
+        with self.__connect() as con:
+            rows = con.execute("SELECT uid FROM temp_dash WHERE expires_at <= ? ORDER BY expires_at LIMIT ?;",
+                               (now, -1 if limit is None else limit)).fetchall()
+        return [row[0] for row in rows]
+
+    """
+    Gets the earliest deadline in the index
+
+    Returns: unix time of the next deadline or None if the index is empty
+    """
+    def next_deadline(self):
+        with self.__connect() as con:
+            row = con.execute("SELECT min(expires_at) FROM temp_dash;").fetchone()
+        return row[0]
+
+    """
+    Removes dashboards from the index
+
+    Args:
+        uids: list of temp dashboard uids
+    """
+    def remove(self, uids):
+        with self.__connect() as con:
+            con.executemany("DELETE FROM temp_dash WHERE uid = ?;", [(uid,) for uid in uids])
+
+    """
+    Gets every dashboard in the index
+
+    Returns: dict of uid -> unix time it expires
+    """
+    def all(self):
+        with self.__connect() as con:
+            return dict(con.execute("SELECT uid, expires_at FROM temp_dash;").fetchall())
+
+    """
+    Imports a CSV temp dashboard log with rows of (uid, creation time).  Dashboards already in the index keep their
+    deadline
+
+    Args:
+        log_file: path of the CSV log
+
+    Returns: number of dashboards imported
+    """
+    def import_log(self, log_file):
+        entries = []
+        with open(log_file, newline='') as read_log:
+            for row in csv.reader(read_log, delimiter=','):
+                if len(row) != 0:
+                    created = datetime.datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S.%f')
+                    entries.append((row[0], created.timestamp() + self.TEMP_DASH_LIFETIME))
+        with self.__connect() as con:
+            before = con.total_changes
+            con.executemany("INSERT OR IGNORE INTO temp_dash (uid, expires_at) VALUES (?, ?);", entries)
+            return con.total_changes - before
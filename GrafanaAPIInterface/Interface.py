@@ -4,17 +4,27 @@ The main web page interface that the users see.  Uses flask to host the web page
 Breaks up each part of the Grafana functionality into seperate directories.
 The templates folder contains all html templates and css styling for rendering the pages.
 """
-from flask import Flask, render_template, redirect, request, jsonify, url_for
+from flask import Flask, render_template, redirect, request, jsonify, url_for, Response
 from flask_wtf import FlaskForm
-from wtforms import SelectField
+from wtforms import SelectField, SelectMultipleField
 import DB_Processor
 import API_Processor
+import Async_API_Processor
+import Column_Parser
+import Query_Builder
+import Metrics
 import pandas as pd
-import copy
+import json
 import os
 from string import digits
 
 LOGO_FOLDER = os.path.join('static', 'logo')
+COLS_MAX_AGE = int(os.environ.get("COLS_MAX_AGE", 3600))
+DASH_SEARCH_LIMIT = 50
+TABLE_SEARCH_LIMIT = 20
+TABLE_SEARCH_MAX_LIMIT = 200
+COLUMN_SEARCH_LIMIT = 100
+COLUMN_SEARCH_MAX_LIMIT = 1000
 
 __db = DB_Processor.db()
 __api = API_Processor.GrafanaAPIProcessor()
@@ -77,93 +87,16 @@ class Form(FlaskForm):
 
 
 """ 
-Cols for each table are selected by checkboxes which are returned as a list when posted.
-The list has to be parsed into a string for the Grafana API
-
-Args:
-    cols: Preformatted list with names of tables and cols ex: t000005c05, t000008c04,...
-
-Returns: Formatted list that breaks up the names into a tablecol ex: t000001c02c04c05, t000052c00,c01,c05
-"""
-def parse_cols(cols):
-    tables_cols = []
-
-    for c in cols:
-        found = False
-        for iterator in tables_cols:
-            if c[0:c.find('c')] == iterator[0]:
-                iterator.append(c[c.find('c'):])
-                found = True
-        if not found:
-            tables_cols.append([c[0:c.find('c'):]])
-            tables_cols[len(tables_cols) - 1].append(c[c.find('c'):])
-    return tables_cols
-
-
-""" 
-Cols for each table are selected by checkboxes which are returned as a list when posted.
-The list has to be parsed into a string for the Grafana API
-
-Args:
-    cols: Preformatted list with names of panels, tables and cols ex: 435t000005c05, 456t000008c04,...
-
-Returns: Formatted list that breaks up the names into a dict for each panel with list of tables and cols
+Form for choosing several dashboards
 """
-def parse_update_temp(cols):
-    panel_template = {
-        "id": "",
-        "tables": []
-    }
-
-    table_template = {
-        "table_name": "",
-        "cols": ""
-    }
-
-    delimiter = '/'
-    panels = []
-    for c in cols:
-        found_panel = False
-        for panel in panels:
-            if c[0:c.find(delimiter)] == panel['id']:
-                index = c.find(delimiter)
-                found_panel = True
-                found_table = False
-                for table in panel['tables']:
-                    if table['table_name'] == c[index + 1:c.find(delimiter, index + 1)]:
-                        index2 = c.find(delimiter, index + 1)
-                        found_table = True
-                        table['cols'] = table['cols'] + ", " + c[index2 + 1:] + " AS \"" \
-                            + __db.convert_tabname_to_smaxvar(c[index + 1:c.find(delimiter, index + 1)])\
-                            + " " + c[index2 + 1:] + '\"'
-                        break
-                if found_table:
-                    break
-                if not found_table:
-                    index = c.find(delimiter)
-                    index2 = c.find(delimiter, index + 1)
-                    panel['tables'].append(table_template.copy())
-                    panel['tables'][-1]['table_name'] = c[index + 1:c.find(delimiter, index + 1)]
-                    panel['tables'][-1]['cols'] = c[index2 + 1:] + " AS \"" \
-                        + __db.convert_tabname_to_smaxvar(c[index + 1:c.find(delimiter, index + 1)])\
-                        + " " + c[index2 + 1:] + '\"'
-                    break
-
-        if not found_panel:
-            index = c.find(delimiter)
-            panels.append(copy.deepcopy(panel_template))
-            panels[-1]['id'] = c[0:index]
-            panels[-1]['tables'].append(table_template.copy())
-            panels[-1]['tables'][-1]['table_name'] = c[int(index) + 1:int(c.find(delimiter, index + 1))]
-            panels[-1]['tables'][-1]['cols'] = c[c.find(delimiter, index + 1) + 1:] + " AS \"" \
-                + __db.convert_tabname_to_smaxvar(c[index + 1:c.find(delimiter, index + 1)]) \
-                + " " + c[c.find(delimiter, index + 1) + 1:] + '\"'
-    return panels
+class MultiForm(FlaskForm):
+    targets = SelectMultipleField('targets', choices=[])
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'abcdefg'
 app.config['UPLOAD_FOLDER'] = LOGO_FOLDER
+Metrics.init_app(app)
 
 """ 
 Reroutes base url to the home page
@@ -188,7 +121,6 @@ Page for creating dashboards
 @app.route('/create_dash', methods=['GET', 'POST'])
 def create_dash():
     form = Form()
-    form.table.choices = __db.get_tables("")
 
     logo = os.path.join(app.config['UPLOAD_FOLDER'], 'sao_logo.jpg')
 
@@ -196,18 +128,7 @@ def create_dash():
         request.method = ''
 
         cols = request.form.getlist('boxes')
-
-        tables_cols = []
-
-        for c in cols:
-            found = False
-            for iterator in tables_cols:
-                if c[0:c.find('c')] == iterator[0]:
-                    iterator.append(c[c.find('c'):])
-                    found = True
-            if not found:
-                tables_cols.append([c[0:c.find('c'):]])
-                tables_cols[len(tables_cols)-1].append(c[c.find('c'):])
+        tables_cols = Column_Parser.parse_cols(cols)
 
         dash_info = {
             "dash_name": request.form['dash_name'],
@@ -227,7 +148,6 @@ Page for creating and embedding temp graphs
 @app.route('/temp_graphs', methods=['GET', 'POST'])
 def temp_graphs():
     form = Form()
-    form.table.choices = __db.get_tables("")
 
     logo = os.path.join(app.config['UPLOAD_FOLDER'], 'sao_logo.jpg')
 
@@ -237,59 +157,64 @@ def temp_graphs():
         if uid is None or uid == "null":
             uid = __api.create_temp_dash()
 
-        if request.form['updated'] == 'true':
-            updated_cols = request.form.getlist('update_boxes')
-            __api.update_temp_dash(uid, parse_update_temp(updated_cols))
-
-        if request.form.get('yminmax_panel_id') is not None:
-            local_min = None
-            local_max = None
-            for input_min, input_max in zip(request.form.getlist('ymin'), request.form.getlist('ymax')):
-                if input_min != "":
-                    local_min = input_min
-                if input_max != "":
-                    local_max = input_max
-                if local_min is not None or local_max is not None:
-                    break
-            if local_max.isdigit() and local_min.isdigit():
-                __api.update_y_min_max(True, request.form.get('yminmax_panel_id'), uid, local_min, local_max)
-
-        time_from = None
-        time_to = None
-
-        if request.form['time_from'] is not None and request.form['time_from'] != "" \
-            and request.form['time_from'].lower().find("now") == -1 \
-                and is_date_format(request.form['time_from']):
-            time_from = convert_time_to_grafana_format(request.form['time_from'])
-        elif is_proper_now(request.form['time_from']):
-            time_from = request.form['time_from']
-
-        if request.form['time_to'] is not None and request.form['time_from'] != "" \
-            and request.form['time_from'].lower().find("now") == -1 \
-                and is_date_format(request.form['time_to']):
-            time_to = convert_time_to_grafana_format(request.form['time_to'])
-        elif is_proper_now(request.form['time_to']):
-            time_to = request.form['time_to']
-
-        if time_to is None or time_to == "":
-            time_to = "now"
-
-        if time_from is not None:
-            __api.update_dash_time(time_from, time_to, True, uid)
-
-        cols = request.form.getlist('boxes')
-        tables_cols = parse_cols(cols)
-
-        src = ""
-        if len(cols) != 0:
-            panel_info = {
-                "graph_name": request.form["graph_name"],
-                "table": tables_cols,
-                "is_temp": True,
-                "uid": uid
-            }
-            panel_id = __api.insert_new_panel(panel_info)
-            src = "http://localhost:3000/d-solo/" + uid + "?refresh=1m&orgId=2&panelId=" + str(panel_id)
+        with __api.edit_dash(True, uid) as edit:
+            if request.form['updated'] == 'true':
+                updated_cols = request.form.getlist('update_boxes')
+                edit.update_temp_dash(Column_Parser.parse_update_temp(updated_cols))
+
+            if request.form.get('yminmax_panel_id') is not None:
+                local_min = None
+                local_max = None
+                for input_min, input_max in zip(request.form.getlist('ymin'), request.form.getlist('ymax')):
+                    if input_min != "":
+                        local_min = input_min
+                    if input_max != "":
+                        local_max = input_max
+                    if local_min is not None or local_max is not None:
+                        break
+                if local_max.isdigit() and local_min.isdigit():
+                    edit.update_y_min_max(request.form.get('yminmax_panel_id'), local_min, local_max)
+
+            time_from = None
+            time_to = None
+
+            if request.form['time_from'] is not None and request.form['time_from'] != "" \
+                and request.form['time_from'].lower().find("now") == -1 \
+                    and is_date_format(request.form['time_from']):
+                time_from = convert_time_to_grafana_format(request.form['time_from'])
+            elif is_proper_now(request.form['time_from']):
+                time_from = request.form['time_from']
+
+            if request.form['time_to'] is not None and request.form['time_from'] != "" \
+                and request.form['time_from'].lower().find("now") == -1 \
+                    and is_date_format(request.form['time_to']):
+                time_to = convert_time_to_grafana_format(request.form['time_to'])
+            elif is_proper_now(request.form['time_to']):
+                time_to = request.form['time_to']
+
+            if time_to is None or time_to == "":
+                time_to = "now"
+
+            if time_from is not None:
+                edit.update_dash_time(time_from, time_to)
+
+            cols = request.form.getlist('boxes')
+            tables_cols = Column_Parser.parse_cols(cols)
+
+            src = ""
+            if len(cols) != 0:
+                panel_info = {
+                    "graph_name": request.form["graph_name"],
+                    "table": tables_cols,
+                    "is_temp": True,
+                    "uid": uid
+                }
+                if request.form.get('downsample') in Query_Builder.AGGREGATES:
+                    panel_info['aggregate'] = request.form['downsample']
+                    if request.form.get('max_points', '').isdigit():
+                        panel_info['max_points'] = int(request.form['max_points'])
+                panel_id = edit.insert_new_panel(panel_info)
+                src = "http://localhost:3000/d-solo/" + uid + "?refresh=1m&orgId=2&panelId=" + str(panel_id)
 
         return redirect(url_for('temp_graphs', src=src, time_from=time_from, time_to=time_to, uid=uid))
 
@@ -301,19 +226,66 @@ Page for inserting temp graphs to permenant dash
 @app.route('/temp_graphs/insert_graphs', methods=['GET', 'POST'])
 def insert_graphs():
     form = Form()
-    form.table.choices = __api.get_dash_info_list()
 
     logo = os.path.join(app.config['UPLOAD_FOLDER'], 'sao_logo.jpg')
 
     if request.method == 'POST':
+        sources = {request.form['uid']: request.form.getlist('boxes')}
         target_uid = form.table.data
-        panel_list = request.form.getlist('boxes')
-        __api.copy_panels(request.form['uid'], target_uid, panel_list)
+
+        async def copy_panels():
+            async with Async_API_Processor.AsyncGrafanaAPIProcessor() as api:
+                await api.copy_panels(sources, target_uid)
+
+        Async_API_Processor.run(copy_panels())
         return redirect(url_for('temp_graphs'))
 
     return render_template("insert_graphs.html", form=form, logo=logo)
 
 
+""" 
+Page for copying graphs from several temp dashboards into several permenant dashes at once.  The temp dashboards
+are given as source arguments ex: /temp_graphs/promote_graphs?source=kX3c9a&source=Pq71bd
+"""
+@app.route('/temp_graphs/promote_graphs', methods=['GET', 'POST'])
+def promote_graphs():
+    form = MultiForm()
+
+    logo = os.path.join(app.config['UPLOAD_FOLDER'], 'sao_logo.jpg')
+
+    if request.method == 'POST':
+        sources = Column_Parser.parse_panel_sources(request.form.getlist('boxes'))
+        target_uids = form.targets.data
+
+        async def promote_panels():
+            async with Async_API_Processor.AsyncGrafanaAPIProcessor() as api:
+                return await api.promote_panels(sources, target_uids)
+
+        results = Async_API_Processor.run(promote_panels())
+        failed = [uid for uid, (status, _) in results.items() if status != 200]
+        if len(failed) != 0:
+            return Response("failed to save dashboards: " + ", ".join(failed), status=502)
+        return redirect(url_for('temp_graphs'))
+
+    source_uids = [uid for uid in request.args.getlist('source') if uid != ""]
+
+    async def get_source_dashes():
+        async with Async_API_Processor.AsyncGrafanaAPIProcessor() as api:
+            return await api.get_dashes(True, source_uids)
+
+    source_dashes = Async_API_Processor.run(get_source_dashes())
+
+    sources = []
+    for uid, dash in zip(source_uids, source_dashes):
+        if 'dashboard' in dash:
+            sources.append({
+                "uid": uid,
+                "panels": [(panel['id'], panel.get('title', '')) for panel in dash['dashboard'].get('panels', [])]
+            })
+
+    return render_template("promote_graphs.html", form=form, logo=logo, sources=sources)
+
+
 """ 
 Incompleted page for recreating dashboards in interface and allowing updates
 """
@@ -328,15 +300,19 @@ Page for deleting pages
 @app.route('/delete_dash', methods=['GET', 'POST'])
 def delete_dash():
     form = Form()
-    form.table.choices = __api.get_dash_info_list()
 
     logo = os.path.join(app.config['UPLOAD_FOLDER'], 'sao_logo.jpg')
 
     if request.method == 'POST':
         dash_list = request.form.getlist('boxes')
-        for dash in dash_list:
-            __api.delete_dash(dash)
+
+        async def delete_dashes():
+            async with Async_API_Processor.AsyncGrafanaAPIProcessor() as api:
+                await api.delete_dashes(False, dash_list)
+
+        Async_API_Processor.run(delete_dashes())
         return redirect(url_for('delete_dash'))
+
     return render_template("delete_dash.html", form=form, list=list, logo=logo)
 
 
@@ -355,7 +331,97 @@ def col(table):
     return jsonify({'col': table_array})
 
 
+""" 
+Hidden directory for uploading the columns of several tables at once.  Served from the schema cache as compact JSON
+{table: [cols]} with an ETag so browsers can revalidate instead of downloading schemas again
+
+Args:
+    tables: comma separated list of tables ex: /cols?tables=t000001,t000002
+"""
+@app.route('/cols')
+def cols():
+    tables = [table for table in request.args.get('tables', '').split(',') if table != ""]
+    table_cols, etag = __db.get_cols(tables)
+
+    response = Response(json.dumps(table_cols, separators=(',', ':')), mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = COLS_MAX_AGE
+    return response.make_conditional(request)
+
+
+""" 
+Searches the main org dashboards by title prefix for the dashboard dropdowns
+
+Args:
+    q: start of the dashboard title, ignoring case
+    limit: maximum number of dashboards returned
+
+Returns: JSON list of [uid, title] sorted by title
+"""
+@app.route('/dash_search')
+def dash_search():
+    limit = request.args.get('limit', str(DASH_SEARCH_LIMIT))
+    limit = int(limit) if limit.isdigit() else DASH_SEARCH_LIMIT
+    return jsonify(__api.get_dash_index(False).search_prefix(request.args.get('q', ''), limit))
+
+
+""" 
+Searches the tables of the titles catalog by smaxvar for the table dropdowns, so pages do not have to ship every
+table.  Exact matches come first, then prefix matches, then matches at the start of a name segment
+
+Args:
+    q: substring of the smaxvar, ignoring case
+    page: page of results to get, starting at 1
+    limit: number of results per page
+
+Returns: JSON {"total": number of matches, "page": page, "tables": list of [tabname, smaxvar]}
+"""
+@app.route('/search/tables')
+def search_tables():
+    page = request.args.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    limit = request.args.get('limit', str(TABLE_SEARCH_LIMIT))
+    limit = min(int(limit), TABLE_SEARCH_MAX_LIMIT) if limit.isdigit() and int(limit) > 0 else TABLE_SEARCH_LIMIT
+    total, tables = __db.search_tables(request.args.get('q', '').strip(), page, limit)
+    return jsonify({"total": total, "page": page, "tables": tables})
+
+
+""" 
+Searches the columns of every table in titles at once, so a graph over several tables can be assembled from one
+search box instead of opening tables one at a time
+
+Args:
+    q: substring of the column name, ignoring case
+    smaxvar: only return tables whose smaxvar contains this, ignoring case
+    limit: maximum number of matches returned
+
+Returns: JSON {"total": number of matches, "columns": list of [tabname, smaxvar, column]}
+"""
+@app.route('/search/columns')
+def search_columns():
+    limit = request.args.get('limit', str(COLUMN_SEARCH_LIMIT))
+    limit = min(int(limit), COLUMN_SEARCH_MAX_LIMIT) if limit.isdigit() and int(limit) > 0 else COLUMN_SEARCH_LIMIT
+    total, columns = __db.search_columns(request.args.get('q', '').strip(), request.args.get('smaxvar', '').strip(),
+                                         limit)
+    return jsonify({"total": total, "columns": columns})
+
+
+""" 
+Loads the titles catalog, the schema cache, the column index and the main org dashboard index so the first requests
+do not wait for them.
+Called at startup by wsgi.py and by python Interface.py when WARM_CACHES is set
+"""
+def warm_caches():
+    __db.get_catalog()
+    __db.get_schema_cache()
+    __db.get_column_index()
+    __api.get_dash_index(False).sync()
+
+
 if __name__ == '__main__':
+    if os.environ.get("WARM_CACHES", "0") not in ("", "0", "false", "False"):
+        warm_caches()
     app.run(debug=True)
 
 
@@ -0,0 +1,267 @@
+"""
+Metrics
+In-process instrumentation for the interface, exposed in the Prometheus text format at /metrics.
+
+Every public method of the classes decorated with instrumented (db and GrafanaAPIProcessor) is timed into the
+interface_step_seconds histogram.  Grafana calls and database queries are counted with count_call, and the size of
+dashboard payloads sent to and received from Grafana is recorded with observe_payload.  For every HTTP request
+init_app records its duration and how many Grafana calls and database queries it made.  A request sent with the header
+"X-Trace: 1" gets a Server-Timing header back listing the time spent in each step, ex:
+    Server-Timing: db.get_cols;dur=0.41, GrafanaAPIProcessor.create_temp_dash;dur=7.90, grafana.save_dash;dur=7.12
+
+Metrics are kept per process, so with several gunicorn workers every worker reports its own.
+"""
+
+import functools
+import threading
+import time
+import types
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+TRACE_HEADER = 'X-Trace'
+
+
+"""
+Trace of one HTTP request: the steps it went through and how many calls of each kind it made
+"""
+class RequestTrace:
+    __slots__ = ('start', 'steps', 'calls')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.steps = []
+        self.calls = {}
+
+
+if contextvars is not None:
+    __current_trace = contextvars.ContextVar('request_trace', default=None)
+
+    def current_trace():
+        return __current_trace.get()
+
+    def set_trace(trace):
+        __current_trace.set(trace)
+else:
+    __local = threading.local()
+
+    def current_trace():
+        return getattr(__local, 'trace', None)
+
+    def set_trace(trace):
+        __local.trace = trace
+
+
+"""
+Histograms and counters with labels, rendered in the Prometheus text format
+"""
+class Registry:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__histograms = {}
+        self.__counters = {}
+        self.__help = {}
+
+    """
+    Records a value in a histogram
+
+    Args:
+        name: metric name
+        value: observed value
+        buckets: upper bounds of the histogram buckets
+        help_text: description of the metric
+        labels: label names and values
+    """
+    def observe(self, name, value, buckets=TIME_BUCKETS, help_text="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__help.setdefault(name, help_text)
+            series = self.__histograms.setdefault(name, {}).get(key)
+            if series is None:
+                series = self.__histograms[name][key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[1][i] += 1
+            series[2] += value
+            series[3] += 1
+
+    """
+    Adds to a counter
+
+    Args:
+        name: metric name
+        amount: amount to add
+        help_text: description of the metric
+        labels: label names and values
+    """
+    def inc(self, name, amount=1, help_text="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__help.setdefault(name, help_text)
+            counter = self.__counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + amount
+
+    @staticmethod
+    def __format_labels(key, extra=()):
+        labels = list(key) + list(extra)
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                              for name, value in labels) + "}"
+
+    """
+    Renders every metric in the Prometheus text exposition format
+
+    Returns: str
+    """
+    def render(self):
+        lines = []
+        with self.__lock:
+            for name, counter in sorted(self.__counters.items()):
+                lines.append("# HELP " + name + " " + self.__help[name])
+                lines.append("# TYPE " + name + " counter")
+                for key, value in sorted(counter.items()):
+                    lines.append(name + self.__format_labels(key) + " " + str(value))
+            for name, histogram in sorted(self.__histograms.items()):
+                lines.append("# HELP " + name + " " + self.__help[name])
+                lines.append("# TYPE " + name + " histogram")
+                for key, (buckets, counts, total, count) in sorted(histogram.items()):
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(name + "_bucket" + self.__format_labels(key, [("le", bound)]) + " "
+                                     + str(bucket_count))
+                    lines.append(name + "_bucket" + self.__format_labels(key, [("le", "+Inf")]) + " " + str(count))
+                    lines.append(name + "_sum" + self.__format_labels(key) + " " + str(total))
+                    lines.append(name + "_count" + self.__format_labels(key) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+"""
+Records how long a step took, in the step histogram and in the current request's trace
+
+Args:
+    step: step name ex: db.get_cols
+    elapsed: seconds the step took
+"""
+def record_step(step, elapsed):
+    registry.observe("interface_step_seconds", elapsed, help_text="Time spent in instrumented steps", step=step)
+    trace = current_trace()
+    if trace is not None:
+        trace.steps.append((step, elapsed))
+
+
+"""
+Counts a call to an external system, in total and for the current request
+
+Args:
+    kind: grafana or db
+    name: call name ex: save_dash
+"""
+def count_call(kind, name):
+    registry.inc("interface_" + kind + "_calls_total", help_text="Calls made to " + kind, call=name)
+    trace = current_trace()
+    if trace is not None:
+        trace.calls[kind] = trace.calls.get(kind, 0) + 1
+
+
+"""
+Records the size of a dashboard payload
+
+Args:
+    direction: sent or received
+    size: payload size in bytes
+"""
+def observe_payload(direction, size):
+    registry.observe("interface_grafana_payload_bytes", size, SIZE_BUCKETS,
+                     help_text="Size of the dashboard JSON exchanged with Grafana", direction=direction)
+
+
+"""
+Times a block of code as one step
+
+Args:
+    step: step name
+"""
+class timed:
+    def __init__(self, step):
+        self.step = step
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record_step(self.step, time.perf_counter() - self.start)
+        return False
+
+
+def __wrap(step, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            record_step(step, time.perf_counter() - start)
+    return wrapper
+
+
+"""
+Class decorator that times every public method of the class as a step named <prefix>.<method>
+
+Args:
+    prefix: step name prefix, defaults to the class name
+
+Returns: class decorator
+"""
+def instrumented(prefix=None):
+    def decorate(cls):
+        name = cls.__name__ if prefix is None else prefix
+        for attr, value in list(vars(cls).items()):
+            if not attr.startswith('_') and isinstance(value, types.FunctionType):
+                setattr(cls, attr, __wrap(name + "." + attr, value))
+        return cls
+    return decorate
+
+
+"""
+Registers the per-request instrumentation and the /metrics route on a Flask app
+
+Args:
+    app: Flask app
+"""
+def init_app(app):
+    from flask import request, Response
+
+    @app.before_request
+    def start_trace():
+        set_trace(RequestTrace())
+
+    @app.after_request
+    def finish_trace(response):
+        trace = current_trace()
+        if trace is None:
+            return response
+        set_trace(None)
+        endpoint = request.endpoint or "unknown"
+        registry.observe("interface_request_seconds", time.perf_counter() - trace.start,
+                         help_text="Duration of HTTP requests", endpoint=endpoint)
+        for kind in ("grafana", "db"):
+            registry.observe("interface_request_" + kind + "_calls", trace.calls.get(kind, 0), COUNT_BUCKETS,
+                             help_text="Calls made to " + kind + " per HTTP request", endpoint=endpoint)
+        if request.headers.get(TRACE_HEADER) == '1':
+            response.headers['Server-Timing'] = ", ".join(step + ";dur=" + "%.2f" % (elapsed * 1000)
+                                                          for step, elapsed in trace.steps)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,118 @@
+"""
+Migrate
+Applies the SQL files in migrations/ to smax_engdb in file name order, each one only once.  Applied migrations are
+recorded in the interface_migrations table.  Statements run one at a time outside of a transaction, so a migration
+can build indexes concurrently; every statement has to end with a semicolon at the end of a line and should be safe
+to run again (IF NOT EXISTS) in case a migration stops half way.
+A CREATE INDEX CONCURRENTLY that fails leaves an INVALID index behind, which IF NOT EXISTS would then skip, so an
+invalid index with the same name is dropped before every CREATE INDEX CONCURRENTLY IF NOT EXISTS.
+"""
+
+import argparse
+import os
+import re
+import DB_Processor
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+"""
+Splits a migration file into its statements, dropping comment lines
+
+Args:
+    text: contents of the migration file
+
+Returns: list of statements
+"""
+def split_statements(text):
+    statements = []
+    current = []
+    for line in text.splitlines():
+        if line.strip().startswith("--"):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip()
+            if statement != ";":
+                statements.append(statement)
+            current = []
+    if "\n".join(current).strip() != "":
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+"""
+Drops the index a statement creates concurrently if a failed earlier run left it INVALID
+
+Args:
+    cur: cursor of an autocommit connection
+    statement: migration statement
+"""
+def drop_invalid_index(cur, statement):
+    match = CONCURRENT_INDEX.match(statement)
+    if match is None:
+        return
+    cur.execute("SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = %s AND pg_table_is_visible(c.oid);", (match.group(1),))
+    row = cur.fetchone()
+    if row is not None and row[0]:
+        print("dropping invalid index " + match.group(1))
+        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS " + match.group(1) + ";")
+
+
+"""
+Gets the migration files that have not been applied yet
+
+Args:
+    applied: set of applied migration file names
+
+Returns: sorted list of migration file names
+"""
+def pending_migrations(applied):
+    return sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith(".sql") and name not in applied)
+
+
+"""
+Applies every pending migration
+
+Args:
+    dry_run: only list the pending migrations
+
+Returns: list of applied (or pending when dry_run) migration file names
+"""
+def migrate(dry_run=False):
+    pool = DB_Processor.db().get_pool()
+    con = pool.getconn()
+    try:
+        con.autocommit = True
+        with con.cursor() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS interface_migrations "
+                        "(name TEXT PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now());")
+            cur.execute("SELECT name FROM interface_migrations;")
+            pending = pending_migrations({row[0] for row in cur.fetchall()})
+            if dry_run:
+                return pending
+
+            for name in pending:
+                with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                    statements = split_statements(f.read())
+                for statement in statements:
+                    drop_invalid_index(cur, statement)
+                    cur.execute(statement)
+                cur.execute("INSERT INTO interface_migrations (name) VALUES (%s);", (name,))
+                print("applied " + name)
+        return pending
+    finally:
+        con.autocommit = False
+        pool.putconn(con)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Applies the pending migrations in migrations/ to smax_engdb")
+    parser.add_argument('--dry-run', action='store_true', help="list the pending migrations without applying them")
+    args = parser.parse_args()
+
+    migrations = migrate(args.dry_run)
+    if args.dry_run:
+        print("\n".join(migrations) if len(migrations) != 0 else "no pending migrations")
@@ -0,0 +1,93 @@
+"""
+Panel ID Allocator
+PanelIDAllocator hands out panel ids for new Grafana panels.  The next free id is stored in panel_id_index.txt.
+Instead of rewriting the file for every panel, each process reserves a block of ids at once while holding an
+exclusive lock on the file and then hands them out from memory, so ids are unique across threads and processes and
+most allocations never touch the file.  A process forked from one that already reserved a block drops the
+inherited block and reserves its own.  Every panel added to a dashboard, new or copied, gets its id from here.
+"""
+
+import threading
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class PanelIDAllocator:
+    INDEX_FILE = os.environ.get("PANEL_ID_INDEX_FILE", "panel_id_index.txt")
+    BLOCK_SIZE = int(os.environ.get("PANEL_ID_BLOCK_SIZE", 20))
+
+    def __init__(self, index_file=None, block_size=None):
+        self.index_file = self.INDEX_FILE if index_file is None else index_file
+        self.block_size = self.BLOCK_SIZE if block_size is None else block_size
+        self.__lock = threading.Lock()
+        self.__next_id = 0
+        self.__block_end = 0
+        self.__pid = os.getpid()
+
+    """
+    Reserves the next block of ids in the index file.  The file is locked while it is read and rewritten so two
+    processes never reserve the same block
+
+    Returns: first id of the reserved block
+    """
+    def __reserve_block(self):
+        with open(self.index_file, 'r+') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                line = f.readline().strip()
+                start = int(line) if line != "" else 0
+                f.seek(0)
+                f.truncate()
+                f.write(str(start + self.block_size))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return start
+
+    """
+    Allocates a new panel id that is unique across all dashboards
+
+    Returns: panel id
+    """
+    def allocate(self):
+        if self.__pid != os.getpid():
+            self.__lock = threading.Lock()
+            self.__next_id = self.__block_end = 0
+            self.__pid = os.getpid()
+        with self.__lock:
+            if self.__next_id >= self.__block_end:
+                self.__next_id = self.__reserve_block()
+                self.__block_end = self.__next_id + self.block_size
+            panel_id = self.__next_id
+            self.__next_id += 1
+        return panel_id
+
+    """
+    Allocates ids for panels appended to a dashboard, skipping any id already used by its panels (including panels
+    nested in collapsed rows), so panels added before the allocator was used are never clashed with
+
+    Args:
+        dash: dashboard JSON as returned by the Grafana API
+        count: number of ids to allocate
+
+    Returns: list of panel ids
+    """
+    def allocate_for_dash(self, dash, count):
+        used = set()
+        for panel in dash['dashboard'].get('panels', []):
+            used.add(int(panel.get('id') or 0))
+            for nested_panel in panel.get('panels', []):
+                used.add(int(nested_panel.get('id') or 0))
+        panel_ids = []
+        while len(panel_ids) < count:
+            panel_id = self.allocate()
+            if panel_id not in used:
+                panel_ids.append(panel_id)
+        return panel_ids
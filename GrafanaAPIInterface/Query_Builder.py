@@ -0,0 +1,214 @@
+"""
+Query Builder
+TargetBuilder builds the query targets of Grafana panels.  Every target selects the time column and the chosen
+columns of one table, with each column aliased as "<smaxvar> <column>".  The SQL comes from one precompiled template
+and the target dict from a flat copy of Panel_Templates.QUERY_TEMPLATE instead of a deepcopy.  The SQL and column
+list of every (table, smaxvar, columns) combination already built are cached, so rebuilding a dashboard's targets
+is mostly dictionary lookups.
+Targets can also be downsampled: rows are bucketed by Grafana's $__interval, which Grafana sizes from the panel's
+maxDataPoints, and every column is reduced with an aggregate (avg/min/max/last), so long time ranges return a
+bounded number of rows.  The aggregate is stored in the target's select list, where Grafana keeps it.
+When a RollupManager is given, downsampled avg/min/max targets also read from the table's rollups: the query is a
+UNION ALL with one branch per source (raw table, minute rollup, hour rollup), each guarded by a condition on
+$__interval_ms so Postgres only scans the coarsest source whose buckets still fit in Grafana's interval.  A rollup
+only covers rows up to its high-water mark, so its branch adds the newer raw rows as partial aggregates
+(min/max/sum/count of a single row) and aggregates both together, and panels ending at now miss no data.
+"""
+
+import functools
+import os
+import DB_Processor
+import Panel_Templates
+
+SQL_TEMPLATE = "SELECT\n  time AS \"time\",\n  {cols}\nFROM {table}\nWHERE $__timeFilter(time)"
+DOWNSAMPLED_SQL_TEMPLATE = "SELECT\n  $__timeGroupAlias(time, $__interval),\n  {cols}\nFROM {table}\n" \
+                           "WHERE $__timeFilter(time)\nGROUP BY 1\nORDER BY 1"
+AGGREGATES = {
+    "avg": "avg({col})",
+    "min": "min({col})",
+    "max": "max({col})",
+    "last": "(array_agg({col} ORDER BY time DESC))[1]"
+}
+ROLLUP_AGGREGATES = {
+    "avg": "sum({col}_sum) / nullif(sum({col}_count), 0)",
+    "min": "min({col}_min)",
+    "max": "max({col}_max)"
+}
+ROLLUP_BRANCH_TEMPLATE = "SELECT\n  $__timeGroupAlias(time, $__interval),\n  {cols}\nFROM {table}\n" \
+                         "WHERE $__timeFilter(time) AND {condition}\nGROUP BY 1"
+ROLLUP_TAIL_BRANCH_TEMPLATE = "SELECT\n  $__timeGroupAlias(time, $__interval),\n  {cols}\nFROM (\n" \
+                              "  SELECT time, {rollup_cols} FROM {rollup}\n" \
+                              "  WHERE $__timeFilter(time) AND time < {high_water} AND {condition}\n" \
+                              "  UNION ALL\n" \
+                              "  SELECT time, {raw_cols} FROM {table}\n" \
+                              "  WHERE $__timeFilter(time) AND time >= {high_water} AND {condition}\n" \
+                              ") AS partials\nGROUP BY 1"
+RAW_PARTIALS = "{col}::double precision AS {col}_min, {col}::double precision AS {col}_max, " \
+               "{col}::double precision AS {col}_sum, ({col} IS NOT NULL)::bigint AS {col}_count"
+TARGET_TEMPLATE = {key: value for key, value in Panel_Templates.QUERY_TEMPLATE.items()
+                   if key not in ('group', 'rawSql', 'refId', 'select', 'table', 'where')}
+
+
+"""
+Builds the column list of a target's SELECT, aliasing every column with the table's smaxvar name
+
+Args:
+    cols: list of columns
+    smaxvar: smaxvar name of the table the columns belong to
+    aggregate: aggregate applied to every column, one of AGGREGATES or None for raw values
+
+Returns: SELECT column list ex: c05 AS "antenna c05", c06 AS "antenna c06"
+"""
+def build_select_list(cols, smaxvar, aggregate=None):
+    if aggregate is None:
+        return ", ".join(col + " AS \"" + smaxvar + " " + col + "\"" for col in cols)
+    return ", ".join(AGGREGATES[aggregate].format(col=col) + " AS \"" + smaxvar + " " + col + "\"" for col in cols)
+
+
+"""
+Builds a downsampled query that picks the coarsest source whose bucket size is not larger than Grafana's interval
+
+Args:
+    table: raw table name
+    cols: list of columns
+    smaxvar: smaxvar name of the table
+    aggregate: one of ROLLUP_AGGREGATES
+    rollups: tuple of (bucket size in seconds, rollup table, high-water mark SQL expression) sorted finest first
+
+Returns: rawSql string
+"""
+def build_rollup_sql(table, cols, smaxvar, aggregate, rollups):
+    bounds = [0] + [bucket * 1000 for bucket, _, _ in rollups]
+    conditions = []
+    for i, lower in enumerate(bounds):
+        condition = []
+        if lower > 0:
+            condition.append("$__interval_ms >= " + str(lower))
+        if i + 1 < len(bounds):
+            condition.append("$__interval_ms < " + str(bounds[i + 1]))
+        conditions.append(" AND ".join(condition) or "TRUE")
+
+    branches = [ROLLUP_BRANCH_TEMPLATE.format(cols=build_select_list(cols, smaxvar, aggregate), table=table,
+                                              condition=conditions[0])]
+    select_list = ", ".join(ROLLUP_AGGREGATES[aggregate].format(col=col) + " AS \"" + smaxvar + " " + col + "\""
+                            for col in cols)
+    rollup_cols = ", ".join(col + suffix for col in cols for suffix in ('_min', '_max', '_sum', '_count'))
+    raw_cols = ", ".join(RAW_PARTIALS.format(col=col) for col in cols)
+    for (_, rollup_table, high_water), condition in zip(rollups, conditions[1:]):
+        branches.append(ROLLUP_TAIL_BRANCH_TEMPLATE.format(cols=select_list, rollup_cols=rollup_cols,
+                                                           rollup=rollup_table, raw_cols=raw_cols, table=table,
+                                                           high_water=high_water, condition=condition))
+    return "\nUNION ALL\n".join(branches) + "\nORDER BY 1"
+
+
+"""
+Gets the aggregate a target was built with
+
+Args:
+    target: target dict built by TargetBuilder
+
+Returns: aggregate name or None if the target selects raw values
+"""
+def aggregate_of(target):
+    for part in target.get('select', [[]])[0]:
+        if part.get('type') == 'aggregate':
+            return part['params'][0]
+    return None
+
+
+"""
+Gets the refId Grafana uses for the target at an index: A, B, ... Z, A26, A27, ...
+
+Args:
+    index: position of the target in its panel
+
+Returns: refId string
+"""
+def ref_id(index):
+    return chr(ord('A') + index) if index < 26 else 'A' + str(index)
+
+
+"""
+Builds and caches panel targets
+
+Args:
+    convert_tabname_to_smaxvar: function converting a tabname to its smaxvar name, defaults to DB_Processor's
+    rollups: RollupManager used to find rollup tables for downsampled targets, None to always query raw tables
+"""
+class TargetBuilder:
+    CACHE_SIZE = int(os.environ.get("TARGET_CACHE_SIZE", 4096))
+
+    def __init__(self, convert_tabname_to_smaxvar=None, rollups=None):
+        if convert_tabname_to_smaxvar is None:
+            convert_tabname_to_smaxvar = DB_Processor.db().convert_tabname_to_smaxvar
+        self.__convert = convert_tabname_to_smaxvar
+        self.__rollups = rollups
+        self.__build_sql = functools.lru_cache(maxsize=self.CACHE_SIZE)(self.__build_sql_uncached)
+
+    @staticmethod
+    def __build_sql_uncached(table, smaxvar, cols, aggregate, rollups):
+        if len(rollups) != 0:
+            return build_rollup_sql(table, cols, smaxvar, aggregate, rollups)
+        template = SQL_TEMPLATE if aggregate is None else DOWNSAMPLED_SQL_TEMPLATE
+        return template.format(cols=build_select_list(cols, smaxvar, aggregate), table=table)
+
+    """
+    Gets the rollups that can serve a downsampled target, and queues the table for rollups otherwise
+
+    Args:
+        table: table name
+        cols: tuple of columns to select
+        aggregate: aggregate of the target
+
+    Returns: tuple of (bucket size in seconds, rollup table, high-water mark SQL expression) covering every column,
+        finest first
+    """
+    def __usable_rollups(self, table, cols, aggregate):
+        if self.__rollups is None or aggregate not in ROLLUP_AGGREGATES:
+            return ()
+        rollups = self.__rollups.get_rollups(table)
+        if len(rollups) == 0:
+            self.__rollups.register(table)
+        return tuple((bucket, rollup_table, high_water) for bucket, rollup_table, rollup_cols, high_water in rollups
+                     if rollup_cols.issuperset(cols))
+
+    """
+    Builds the target for one table
+
+    Args:
+        table: table name
+        cols: list of columns to select
+        index: position of the target in its panel, used for its refId
+        aggregate: downsample with this aggregate, one of AGGREGATES or None for raw values
+
+    Returns: target dict for a panel's targets list
+    """
+    def build_target(self, table, cols, index=0, aggregate=None):
+        if aggregate is not None and aggregate not in AGGREGATES:
+            raise ValueError("unknown aggregate " + str(aggregate))
+        cols = tuple(cols)
+        target = dict(TARGET_TEMPLATE)
+        target['where'] = []
+        rollups = self.__usable_rollups(table, cols, aggregate)
+        target['rawSql'] = self.__build_sql(table, self.__convert(table), cols, aggregate, rollups)
+        target['refId'] = ref_id(index)
+        target['select'] = [[{"params": list(cols), "type": "column"}]]
+        target['table'] = table
+        if aggregate is None:
+            target['group'] = []
+        else:
+            target['group'] = [{"params": ["$__interval", "none"], "type": "time"}]
+            target['select'][0].append({"params": [aggregate], "type": "aggregate"})
+        return target
+
+    """
+    Builds the targets for several tables
+
+    Args:
+        tables_cols: list of (table, cols) pairs
+        aggregate: downsample with this aggregate, one of AGGREGATES or None for raw values
+
+    Returns: list of target dicts in the same order
+    """
+    def build_targets(self, tables_cols, aggregate=None):
+        return [self.build_target(table, cols, index, aggregate) for index, (table, cols) in enumerate(tables_cols)]
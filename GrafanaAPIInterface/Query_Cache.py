@@ -0,0 +1,255 @@
+"""
+Query Cache
+Caching datasource that sits between Grafana and smax_engdb.  Temp graphs refresh every minute for every viewer, so
+Postgres used to get the same range query over and over.  This service speaks the Grafana JSON datasource protocol
+(/, /search and /query) and answers range queries from an in-memory cache.
+
+QueryCache splits every query into fixed time buckets of BUCKET_SECONDS and caches the rows of each
+(table, columns, bucket) in an LRU capped at MAX_BYTES.  Buckets that ended more than SETTLE_SECONDS ago are
+complete and never fetched again.  The bucket that is still filling up remembers how far it has been fetched, so a
+sliding "now-6h" window only fetches the new tail (plus SETTLE_SECONDS of overlap for late rows) on every refresh.
+
+Targets are written as <table>/<col>,<col> ex: t000005/c05,c06.  Every column is returned as its own series named
+"<smaxvar> <column>", matching the panels built by the Query Builder.
+
+Usage:
+    python Query_Cache.py       serve on QUERY_CACHE_HOST:QUERY_CACHE_PORT
+"""
+
+from collections import OrderedDict
+import datetime
+import threading
+import time
+import os
+from flask import Flask, request, jsonify
+from psycopg2 import sql
+import DB_Processor
+
+BUCKET_SECONDS = int(os.environ.get("QUERY_CACHE_BUCKET_SECONDS", 3600))
+SETTLE_SECONDS = int(os.environ.get("QUERY_CACHE_SETTLE_SECONDS", 300))
+MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_MB", 256)) * 1024 * 1024
+# rough size of one cached value (a float or a timestamp in a tuple) and of one cache entry without its rows
+VALUE_BYTES = 24
+ENTRY_BYTES = 512
+TARGET_DELIMITER = '/'
+COL_DELIMITER = ','
+SEARCH_LIMIT = 100
+
+
+"""
+Rows of one (table, columns, bucket).  settled_until is the time in unix seconds up to which the rows are final:
+the end of the fetched data, or SETTLE_SECONDS before the fetch for data that may still receive late rows
+"""
+class _Bucket:
+    __slots__ = ('rows', 'settled_until', 'size')
+
+    def __init__(self, rows, fetched_until, now, width):
+        self.rows = rows
+        self.settled_until = min(fetched_until, now - SETTLE_SECONDS)
+        self.size = ENTRY_BYTES + len(rows) * width * VALUE_BYTES
+
+
+"""
+Fetches rows of a table from smax_engdb
+
+Args:
+    table: table name
+    cols: tuple of columns
+    start: unix seconds, inclusive
+    end: unix seconds, exclusive
+
+Returns: list of (unix milliseconds, value, value, ...) ordered by time
+"""
+def fetch_rows(table, cols, start, end):
+    query = sql.SQL("SELECT (extract(epoch FROM time) * 1000)::double precision, {cols} FROM {table} "
+                    "WHERE time >= to_timestamp(%s) AND time < to_timestamp(%s) ORDER BY time;").format(
+        cols=sql.SQL(", ").join(sql.Identifier(col) for col in cols),
+        table=sql.Identifier(table))
+    rows, _ = DB_Processor.db().get_pool().execute(query, (start, end))
+    return [tuple(row) for row in rows]
+
+
+"""
+LRU cache of time bucketed query results
+
+Args:
+    fetch: function (table, cols, start, end) -> rows used on a miss, defaults to fetch_rows
+    max_bytes: memory cap of the cached rows
+    bucket_seconds: width of one cached time bucket
+"""
+class QueryCache:
+    def __init__(self, fetch=fetch_rows, max_bytes=MAX_BYTES, bucket_seconds=BUCKET_SECONDS):
+        self.__fetch = fetch
+        self.__max_bytes = max_bytes
+        self.__bucket_seconds = bucket_seconds
+        self.__buckets = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.stats = {"hits": 0, "tail_fetches": 0, "misses": 0, "evictions": 0}
+
+    def __get(self, key):
+        with self.__lock:
+            bucket = self.__buckets.get(key)
+            if bucket is not None:
+                self.__buckets.move_to_end(key)
+            return bucket
+
+    def __put(self, key, bucket):
+        with self.__lock:
+            old = self.__buckets.pop(key, None)
+            if old is not None:
+                self.__size -= old.size
+            self.__buckets[key] = bucket
+            self.__size += bucket.size
+            while self.__size > self.__max_bytes and len(self.__buckets) > 1:
+                _, evicted = self.__buckets.popitem(last=False)
+                self.__size -= evicted.size
+                self.stats["evictions"] += 1
+
+    """
+    Gets the rows of a table between two times, fetching only the buckets (or bucket tails) that are not cached
+
+    Args:
+        table: table name
+        cols: list of columns
+        start: unix seconds, inclusive
+        end: unix seconds, exclusive
+        now: current unix time, defaults to time.time()
+
+    Returns: list of (unix milliseconds, value, value, ...) ordered by time
+    """
+    def get(self, table, cols, start, end, now=None):
+        if now is None:
+            now = time.time()
+        cols = tuple(cols)
+        end = min(end, now)
+        width = self.__bucket_seconds
+
+        rows = []
+        bucket_start = start - start % width
+        while bucket_start < end:
+            bucket_end = bucket_start + width
+            key = (table, cols, bucket_start)
+            fetch_end = min(bucket_end, now)
+            bucket = self.__get(key)
+
+            if bucket is None:
+                self.stats["misses"] += 1
+                bucket = _Bucket(self.__fetch(table, cols, bucket_start, fetch_end), fetch_end, now, len(cols) + 1)
+                self.__put(key, bucket)
+            elif bucket.settled_until < min(bucket_end, end):
+                # only the tail is missing or unsettled: refetch from the last settled point to pick up late rows
+                self.stats["tail_fetches"] += 1
+                tail_start = max(bucket_start, bucket.settled_until)
+                tail_start_ms = tail_start * 1000
+                kept = [row for row in bucket.rows if row[0] < tail_start_ms]
+                bucket = _Bucket(kept + self.__fetch(table, cols, tail_start, fetch_end), fetch_end, now,
+                                 len(cols) + 1)
+                self.__put(key, bucket)
+            else:
+                self.stats["hits"] += 1
+
+            rows += bucket.rows
+            bucket_start = bucket_end
+
+        start_ms, end_ms = start * 1000, end * 1000
+        return [row for row in rows if start_ms <= row[0] < end_ms]
+
+    """
+    Gets the memory used by the cached rows
+
+    Returns: (estimated bytes, number of buckets)
+    """
+    def size(self):
+        with self.__lock:
+            return self.__size, len(self.__buckets)
+
+    """
+    Drops every cached bucket
+    """
+    def clear(self):
+        with self.__lock:
+            self.__buckets.clear()
+            self.__size = 0
+
+
+"""
+Parses a target string
+
+Args:
+    target: <table>/<col>,<col> ex: t000005/c05,c06
+
+Returns: (table, list of cols)
+"""
+def parse_target(target):
+    table, cols = target.split(TARGET_DELIMITER, 1)
+    return table, [col for col in cols.split(COL_DELIMITER) if col != '']
+
+
+"""
+Converts a Grafana range time to unix seconds
+
+Args:
+    value: ISO 8601 time ex: 2021-07-01T00:00:00.000Z
+
+Returns: unix seconds
+"""
+def parse_grafana_time(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+"""
+Builds the Flask app serving the Grafana JSON datasource protocol
+
+Args:
+    cache: QueryCache to answer queries from
+    convert_tabname_to_smaxvar: function naming the series, defaults to DB_Processor's
+
+Returns: Flask app
+"""
+def create_app(cache=None, convert_tabname_to_smaxvar=None):
+    cache = QueryCache() if cache is None else cache
+    if convert_tabname_to_smaxvar is None:
+        convert_tabname_to_smaxvar = DB_Processor.db().convert_tabname_to_smaxvar
+    app = Flask(__name__)
+
+    @app.route('/', methods=['GET'])
+    def health():
+        size, buckets = cache.size()
+        return jsonify({"status": "ok", "bytes": size, "buckets": buckets, **cache.stats})
+
+    @app.route('/search', methods=['POST'])
+    def search():
+        search_key = (request.get_json(silent=True) or {}).get('target', '')
+        _, matches = DB_Processor.db().search_tables(search_key, 1, SEARCH_LIMIT)
+        return jsonify([{"text": smaxvar, "value": tabname + TARGET_DELIMITER} for tabname, smaxvar in matches])
+
+    @app.route('/query', methods=['POST'])
+    def query():
+        body = request.get_json()
+        start = parse_grafana_time(body['range']['from'])
+        end = parse_grafana_time(body['range']['to'])
+        output = []
+        for target in body.get('targets', []):
+            if target.get('hide') or TARGET_DELIMITER not in target.get('target', ''):
+                continue
+            table, cols = parse_target(target['target'])
+            if len(cols) == 0:
+                # a table picked from /search before any column was added to it
+                continue
+            rows = cache.get(table, cols, start, end)
+            smaxvar = convert_tabname_to_smaxvar(table)
+            for i, col in enumerate(cols, 1):
+                output.append({
+                    "target": smaxvar + " " + col,
+                    "datapoints": [[row[i], row[0]] for row in rows]
+                })
+        return jsonify(output)
+
+    return app
+
+
+if __name__ == '__main__':
+    create_app().run(host=os.environ.get("QUERY_CACHE_HOST", "127.0.0.1"),
+                     port=int(os.environ.get("QUERY_CACHE_PORT", 5001)), threaded=True)
@@ -0,0 +1,338 @@
+"""
+Rollup Manager
+RollupManager maintains per-minute and per-hour rollup tables for engineering tables that have been graphed with
+downsampling.  Every rollup row holds the min, max, sum and count of each numeric column for one time bucket.
+Rollups live in their own schema (ROLLUP_SCHEMA) and are refreshed incrementally: each refresh only aggregates rows
+newer than the table's high-water mark (minus REFRESH_LAG, to pick up late rows), and hourly rollups are built from
+the minute rollups instead of the raw table.  The high-water marks and the rolled up columns of every table are kept
+in the rollup_state table, which the TargetBuilder reads through get_rollups to pick the coarsest rollup that still
+meets a panel's resolution.
+
+Rollups write to smax_engdb, so they are only used when ROLLUPS_ENABLED=1.  The web server only queues the tables it
+graphs for registration; a background thread adds them to rollup_state and logs failures (such as a database role
+without INSERT on rollup_state) without failing the request.  The schema and the rollup tables themselves are only
+created by the refresh process:
+    python Rollup_Manager.py            refresh every REFRESH_INTERVAL seconds
+    python Rollup_Manager.py --once     refresh every registered table once and exit
+"""
+
+import argparse
+import datetime
+import logging
+import threading
+import time
+import os
+import psycopg2
+from psycopg2 import sql
+import DB_Processor
+
+ROLLUP_SCHEMA = os.environ.get("ROLLUP_SCHEMA", "rollup")
+REFRESH_INTERVAL = int(os.environ.get("ROLLUP_REFRESH_INTERVAL", 60))
+REFRESH_LAG = datetime.timedelta(seconds=int(os.environ.get("ROLLUP_REFRESH_LAG", 300)))
+BACKFILL = datetime.timedelta(days=int(os.environ.get("ROLLUP_BACKFILL_DAYS", 365)))
+NUMERIC_TYPES = ('smallint', 'integer', 'bigint', 'real', 'double precision', 'numeric')
+
+logger = logging.getLogger(__name__)
+
+# (name, bucket size in seconds, date_trunc field, resolution the rollup is built from)
+RESOLUTIONS = (
+    ('1m', 60, 'minute', None),
+    ('1h', 3600, 'hour', '1m'),
+)
+
+
+"""
+In-memory copy of the rollup_state table, used to answer get_rollups without a query.  If the first load fails (ex:
+rollup_state does not exist yet) the catalog is empty until the background thread's next successful refresh, instead
+of running the failing query again for every target
+"""
+class RollupCatalog(DB_Processor.RefreshingCache):
+    REFRESH_TTL = int(os.environ.get("ROLLUP_CATALOG_TTL", 600))
+    CHECK_INTERVAL = int(os.environ.get("ROLLUP_CATALOG_CHECK_INTERVAL", 60))
+    NAME = "rollup-catalog"
+
+    def __init__(self, load_rows, load_version):
+        super().__init__(load_rows, load_version)
+        self.__load_failed = False
+
+    def refresh(self, force=False):
+        loaded = super().refresh(force)
+        self.__load_failed = False
+        return loaded
+
+    def snapshot(self):
+        if self.__load_failed:
+            return {}
+        try:
+            return super().snapshot()
+        except psycopg2.Error:
+            self.__load_failed = True
+            raise
+
+    def build_snapshot(self, columns, rows):
+        seconds = {name: bucket for name, bucket, _, _ in RESOLUTIONS}
+        rollups = {}
+        for table_name, resolution, high_water, cols in rows:
+            if high_water is not None and resolution in seconds:
+                rollups.setdefault(table_name, []).append(
+                    (seconds[resolution], ROLLUP_SCHEMA + "." + rollup_table_name(table_name, resolution),
+                     frozenset(cols), high_water_sql(table_name, resolution)))
+        return {table_name: tuple(sorted(table_rollups)) for table_name, table_rollups in rollups.items()}
+
+
+"""
+Gets the name of a table's rollup table
+
+Args:
+    table_name: engineering table
+    resolution: rollup resolution name ex: 1m
+
+Returns: rollup table name without the schema
+"""
+def rollup_table_name(table_name, resolution):
+    return table_name + "_" + resolution
+
+
+"""
+Builds a SQL expression for a rollup's high-water mark.  The mark is read when Grafana runs the query, so saved
+panels always split rollup and raw rows at the current mark
+
+Args:
+    table_name: engineering table
+    resolution: rollup resolution name ex: 1m
+
+Returns: SQL expression, -infinity if the rollup is gone
+"""
+def high_water_sql(table_name, resolution):
+    return "coalesce((SELECT high_water FROM " + ROLLUP_SCHEMA + ".rollup_state WHERE table_name = '" \
+           + table_name.replace("'", "''") + "' AND resolution = '" + resolution + "'), '-infinity')"
+
+
+"""
+Creates and refreshes rollup tables
+
+Args:
+    pool: ConnectionPool for smax_engdb, defaults to DB_Processor's shared pool
+"""
+class RollupManager:
+    def __init__(self, pool=None):
+        self.__pool = DB_Processor.db().get_pool() if pool is None else pool
+        self.__registered = set()
+        self.__pending = set()
+        self.__wake = threading.Event()
+        self.__registrar = None
+        self.__lock = threading.Lock()
+        self.__catalog = None
+
+    """
+    Creates the rollup schema and the rollup_state table if they do not exist
+    """
+    def setup(self):
+        with self.__pool.cursor() as cur:
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {};").format(sql.Identifier(ROLLUP_SCHEMA)))
+            cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {}.rollup_state ("
+                                "table_name text NOT NULL, resolution text NOT NULL, high_water timestamptz, "
+                                "cols text[] NOT NULL DEFAULT '{{}}', PRIMARY KEY (table_name, resolution));")
+                        .format(sql.Identifier(ROLLUP_SCHEMA)))
+
+    def __get_catalog(self):
+        if self.__catalog is None:
+            with self.__lock:
+                if self.__catalog is None:
+                    state = sql.SQL("{}.rollup_state").format(sql.Identifier(ROLLUP_SCHEMA))
+                    catalog = RollupCatalog(
+                        lambda: self.__load(sql.SQL("SELECT table_name, resolution, high_water, cols FROM {};")
+                                            .format(state)),
+                        lambda: self.__pool.execute(sql.SQL("SELECT count(*), max(high_water) FROM {};")
+                                                    .format(state), fetch="one")[0])
+                    catalog.start()
+                    self.__catalog = catalog
+        return self.__catalog
+
+    def __load(self, query):
+        rows, description = self.__pool.execute(query)
+        return [column[0] for column in description], rows
+
+    """
+    Queues a table to be rolled up and returns right away.  The registration thread adds it to rollup_state and the
+    rollup tables are created by the next refresh
+
+    Args:
+        table_name: engineering table
+    """
+    def register(self, table_name):
+        if table_name in self.__registered:
+            return
+        with self.__lock:
+            self.__registered.add(table_name)
+            self.__pending.add(table_name)
+            if self.__registrar is None or not self.__registrar.is_alive():
+                self.__registrar = threading.Thread(target=self.__run_registrar, name="rollup-registrar",
+                                                    daemon=True)
+                self.__registrar.start()
+        self.__wake.set()
+
+    """
+    Adds every queued table to rollup_state.  Tables that fail are dropped from the queue and logged, they are queued
+    again the next time they are graphed
+    """
+    def register_pending(self):
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = set()
+        for table_name in sorted(pending):
+            try:
+                with self.__pool.cursor() as cur:
+                    for resolution, _, _, _ in RESOLUTIONS:
+                        cur.execute(sql.SQL("INSERT INTO {}.rollup_state (table_name, resolution) VALUES (%s, %s) "
+                                            "ON CONFLICT DO NOTHING;").format(sql.Identifier(ROLLUP_SCHEMA)),
+                                    (table_name, resolution))
+            except psycopg2.Error:
+                logger.exception("registering %s for rollups failed", table_name)
+                with self.__lock:
+                    self.__registered.discard(table_name)
+
+    def __run_registrar(self):
+        while True:
+            self.__wake.wait()
+            self.__wake.clear()
+            self.register_pending()
+
+    """
+    Gets the rollups of a table that have been refreshed at least once
+
+    Args:
+        table_name: engineering table
+
+    Returns: tuple of (bucket size in seconds, qualified rollup table name, frozenset of rolled up columns,
+        high-water mark SQL expression), finest first
+    """
+    def get_rollups(self, table_name):
+        try:
+            return self.__get_catalog().snapshot().get(table_name, ())
+        except psycopg2.Error:
+            logger.exception("loading the rollup catalog failed, using raw tables until the next refresh")
+            return ()
+
+    def __numeric_cols(self, table_name):
+        rows, _ = self.__pool.execute("SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS "
+                                      "WHERE table_name = %s AND column_name <> 'time' AND data_type IN %s "
+                                      "ORDER BY ordinal_position;", (table_name, NUMERIC_TYPES))
+        return [row[0] for row in rows]
+
+    def __create_rollup_table(self, cur, rollup_table, cols):
+        col_defs = [sql.SQL("time timestamptz PRIMARY KEY")]
+        for col in cols:
+            col_defs += [sql.SQL("{} double precision").format(sql.Identifier(col + "_min")),
+                         sql.SQL("{} double precision").format(sql.Identifier(col + "_max")),
+                         sql.SQL("{} double precision").format(sql.Identifier(col + "_sum")),
+                         sql.SQL("{} bigint").format(sql.Identifier(col + "_count"))]
+        cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {}.{} ({});")
+                    .format(sql.Identifier(ROLLUP_SCHEMA), sql.Identifier(rollup_table), sql.SQL(", ").join(col_defs)))
+
+    """
+    Refreshes one rollup of a table from its high-water mark up to the last complete bucket
+
+    Args:
+        table_name: engineering table
+        resolution: rollup resolution name ex: 1m
+        cols: numeric columns to roll up
+        high_water: end of the data already rolled up, None if the rollup is new
+    """
+    def __refresh_rollup(self, table_name, resolution, cols, high_water):
+        _, bucket, trunc_field, source_resolution = next(r for r in RESOLUTIONS if r[0] == resolution)
+        rollup_table = rollup_table_name(table_name, resolution)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        end = now - datetime.timedelta(seconds=now.timestamp() % bucket)
+        start = now - BACKFILL if high_water is None else high_water - REFRESH_LAG
+        start = start - datetime.timedelta(seconds=start.timestamp() % bucket)
+
+        if source_resolution is None:
+            source = sql.Identifier(table_name)
+            aggregates = [sql.SQL("min({0}), max({0}), sum({0}), count({0})").format(sql.Identifier(col))
+                          for col in cols]
+        else:
+            source = sql.SQL("{}.{}").format(sql.Identifier(ROLLUP_SCHEMA),
+                                             sql.Identifier(rollup_table_name(table_name, source_resolution)))
+            aggregates = [sql.SQL("min({}), max({}), sum({}), sum({})")
+                          .format(*[sql.Identifier(col + suffix) for suffix in ('_min', '_max', '_sum', '_count')])
+                          for col in cols]
+
+        targets = [sql.Identifier(col + suffix) for col in cols for suffix in ('_min', '_max', '_sum', '_count')]
+        query = sql.SQL("INSERT INTO {schema}.{rollup} (time, {targets}) "
+                        "SELECT date_trunc({field}, time) AS bucket, {aggregates} FROM {source} "
+                        "WHERE time >= %s AND time < %s GROUP BY 1 "
+                        "ON CONFLICT (time) DO UPDATE SET {updates};").format(
+            schema=sql.Identifier(ROLLUP_SCHEMA),
+            rollup=sql.Identifier(rollup_table),
+            targets=sql.SQL(", ").join(targets),
+            field=sql.Literal(trunc_field),
+            aggregates=sql.SQL(", ").join(aggregates),
+            source=source,
+            updates=sql.SQL(", ").join(sql.SQL("{0} = EXCLUDED.{0}").format(target) for target in targets))
+
+        with self.__pool.cursor() as cur:
+            self.__create_rollup_table(cur, rollup_table, cols)
+            cur.execute(query, (start, end))
+            cur.execute(sql.SQL("UPDATE {}.rollup_state SET high_water = %s, cols = %s "
+                                "WHERE table_name = %s AND resolution = %s;").format(sql.Identifier(ROLLUP_SCHEMA)),
+                        (end, cols, table_name, resolution))
+
+    """
+    Refreshes every rollup of every registered table, finest resolution first
+
+    Returns: number of rollups refreshed
+    """
+    def refresh_all(self):
+        rows, _ = self.__pool.execute(sql.SQL("SELECT table_name, resolution, high_water, cols FROM {}.rollup_state;")
+                                      .format(sql.Identifier(ROLLUP_SCHEMA)))
+        state = {(table_name, resolution): (high_water, cols) for table_name, resolution, high_water, cols in rows}
+        refreshed = 0
+        for table_name in sorted({table_name for table_name, _ in state}):
+            cols = None
+            for resolution, _, _, _ in RESOLUTIONS:
+                if (table_name, resolution) not in state:
+                    continue
+                high_water, rolled_up_cols = state[(table_name, resolution)]
+                if cols is None:
+                    cols = list(rolled_up_cols) if high_water is not None else self.__numeric_cols(table_name)
+                if len(cols) == 0:
+                    break
+                self.__refresh_rollup(table_name, resolution, cols, high_water)
+                refreshed += 1
+        return refreshed
+
+    """
+    Refreshes every REFRESH_INTERVAL seconds forever
+    """
+    def run_forever(self):
+        while True:
+            try:
+                self.refresh_all()
+            except Exception:
+                logger.exception("rollup refresh failed")
+            time.sleep(REFRESH_INTERVAL)
+
+
+"""
+Gets the rollup manager used for query generation
+
+Returns: RollupManager if ROLLUPS_ENABLED is set, else None
+"""
+def from_env():
+    if os.environ.get("ROLLUPS_ENABLED", "0") in ("", "0", "false", "False"):
+        return None
+    return RollupManager()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Refreshes the rollup tables of graphed engineering tables")
+    parser.add_argument('--once', action='store_true', help="refresh every registered table once and exit")
+    args = parser.parse_args()
+
+    manager = RollupManager()
+    manager.setup()
+    if args.once:
+        print("refreshed " + str(manager.refresh_all()) + " rollups")
+    else:
+        manager.run_forever()
@@ -0,0 +1,144 @@
+"""
+Temp Dash Pool
+Pool of empty temp dashboards created ahead of time, so a new user session gets its dashboard without waiting on
+Grafana.  The pooled uids are kept in a SQLite table next to the expiry index and handed out inside an immediate
+transaction, so two requests (or two worker processes) never get the same dashboard.  A background thread refills
+the pool whenever a dashboard is taken.  Every worker process runs its own refill thread, so the refill holds an
+exclusive lock on <index file>.fill.lock and checks the shared pool size before each dashboard it creates.  Pooled
+dashboards are not in the expiry index until they are handed out, and the reaper leaves them alone.
+"""
+
+from contextlib import contextmanager
+import logging
+import sqlite3
+import threading
+import time
+import os
+import Expiry_Index
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TempDashPool:
+    INDEX_FILE = os.environ.get("TEMP_DASH_POOL_FILE", Expiry_Index.ExpiryIndex.INDEX_FILE)
+    POOL_SIZE = int(os.environ.get("TEMP_DASH_POOL_SIZE", 5))
+    RETRY_INTERVAL = int(os.environ.get("TEMP_DASH_POOL_RETRY_INTERVAL", 30))
+
+    """
+    Args:
+        index_file: SQLite file holding the pooled uids
+        size: number of dashboards to keep ready, 0 disables the pool
+    """
+    def __init__(self, index_file=None, size=None):
+        self.index_file = self.INDEX_FILE if index_file is None else index_file
+        self.size = self.POOL_SIZE if size is None else size
+        self.__create = None
+        self.__wake = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        with self.__connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS temp_dash_pool (uid TEXT PRIMARY KEY, created_at REAL NOT NULL);")
+
+    @contextmanager
+    def __connect(self):
+        con = sqlite3.connect(self.index_file, timeout=30, isolation_level=None)
+        try:
+            yield con
+        finally:
+            con.close()
+
+    """
+    Takes the oldest dashboard out of the pool and wakes the refill thread
+
+    Returns: uid of the dashboard or None if the pool is empty
+    """
+    def take(self):
+        with self.__connect() as con:
+            con.execute("BEGIN IMMEDIATE;")
+            try:
+                row = con.execute("SELECT uid FROM temp_dash_pool ORDER BY created_at LIMIT 1;").fetchone()
+                if row is not None:
+                    con.execute("DELETE FROM temp_dash_pool WHERE uid = ?;", (row[0],))
+                con.execute("COMMIT;")
+            except sqlite3.Error:
+                con.execute("ROLLBACK;")
+                raise
+        self.__wake.set()
+        return None if row is None else row[0]
+
+    """
+    Adds a created dashboard to the pool
+
+    Args:
+        uid: temp dashboard uid
+    """
+    def put(self, uid):
+        with self.__connect() as con:
+            con.execute("INSERT OR REPLACE INTO temp_dash_pool (uid, created_at) VALUES (?, ?);", (uid, time.time()))
+
+    """
+    Gets every pooled dashboard
+
+    Returns: set of uids
+    """
+    def all(self):
+        with self.__connect() as con:
+            return {row[0] for row in con.execute("SELECT uid FROM temp_dash_pool;").fetchall()}
+
+    @contextmanager
+    def __fill_lock(self):
+        with open(self.index_file + ".fill.lock", 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    """
+    Creates dashboards until the pool is full.  The size of the pool is checked under the fill lock, so workers
+    refilling at the same time do not overfill it
+
+    Args:
+        create: function that creates an empty temp dashboard and returns its uid
+
+    Returns: number of dashboards created
+    """
+    def fill(self, create):
+        created = 0
+        with self.__fill_lock():
+            while len(self.all()) < self.size:
+                self.put(create())
+                created += 1
+        return created
+
+    def __run(self):
+        while True:
+            try:
+                self.fill(self.__create)
+                self.__wake.wait()
+            except Exception:
+                logger.exception("temp dash pool refill failed")
+                self.__wake.wait(self.RETRY_INTERVAL)
+            self.__wake.clear()
+
+    """
+    Starts the background refill thread if it is not running yet in this process
+
+    Args:
+        create: function that creates an empty temp dashboard and returns its uid
+    """
+    def start(self, create):
+        if self.size <= 0 or (self.__thread is not None and self.__thread.is_alive()):
+            return
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__create = create
+                self.__thread = threading.Thread(target=self.__run, name="temp-dash-pool", daemon=True)
+                self.__thread.start()
@@ -0,0 +1,20 @@
+"""
+gunicorn_config.py
+gunicorn settings for wsgi.py.  Every setting can be overridden with the environment variable next to it.
+The app is not preloaded, so every worker imports it, and connects to the database and Grafana, after the fork.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+preload_app = False
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
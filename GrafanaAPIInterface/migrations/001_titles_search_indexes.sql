@@ -0,0 +1,6 @@
+-- Indexes for looking up the titles table by name.  Exact lookups on tabname use titles_tabname_idx and exact and
+-- prefix lookups on smaxvar (smaxvar = 'x', smaxvar LIKE 'x%') use titles_smaxvar_pattern_idx.  Substring searches
+-- are answered from the in-memory titles catalog and do not need an index.
+-- The indexes are built concurrently so titles stays writable while they are created.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS titles_tabname_idx ON titles (tabname);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS titles_smaxvar_pattern_idx ON titles (smaxvar text_pattern_ops);
@@ -0,0 +1,23 @@
+"""
+wsgi.py
+Production entry point for the web interface.  Runs Interface.py's Flask app under gunicorn with several worker
+processes, each with several threads:
+
+    gunicorn -c gunicorn_config.py wsgi:app
+
+Every worker opens its own database connections and Grafana sessions after it is forked.  State that has to agree
+across workers is kept outside the process: panel ids in panel_id_index.txt (file lock), temp dashboard deadlines
+and the temp dashboard pool in temp_dash_expiry.db (SQLite), and dashboards themselves in Grafana, where saves are
+versioned so a worker with a stale cached copy refetches instead of overwriting.  The in-memory caches (titles,
+schema, dashboard index) are per worker and refresh in the background.
+
+Set WARM_CACHES=1 to load the caches when each worker starts instead of on its first request.
+"""
+
+import os
+import Interface
+
+app = Interface.app
+
+if os.environ.get("WARM_CACHES", "0") not in ("", "0", "false", "False"):
+    Interface.warm_caches()